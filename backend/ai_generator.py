@@ -1,8 +1,23 @@
+import asyncio
+import contextvars
+import hashlib
+import json
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass, field
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional
 
 import anthropic
 
+# Marks the end of a static prompt prefix for Anthropic prompt caching. Sonnet 4
+# only caches prefixes of at least 1024 tokens, and the tools plus system
+# prompt come to roughly 400 (compact) to 800 (full) tokens, so the API
+# currently ignores these breakpoints. They cost nothing and take effect once
+# the prefix grows; check usage.cache_read_input_tokens before counting on it
+CACHE_CONTROL = {"type": "ephemeral"}
+
+# Beta header for compact tool_use output, only supported by Claude 3.7 Sonnet
+TOKEN_EFFICIENT_TOOLS_HEADER = {"anthropic-beta": "token-efficient-tools-2025-02-19"}
+
 
 @dataclass
 class RoundContext:
@@ -14,6 +29,7 @@ class RoundContext:
     messages: List[Dict[str, Any]] = field(default_factory=list)
     current_round: int = 0
     errors: List[str] = field(default_factory=list)
+    base_system: List[Dict[str, Any]] = field(default_factory=list)
 
     def __post_init__(self):
         """Initialize messages with the original query"""
@@ -70,13 +86,67 @@ All responses must be:
 Provide only the direct answer to what was asked.
 """
 
-    def __init__(self, api_key: str, model: str):
+    # Condensed rewrite of SYSTEM_PROMPT, roughly a third of the tokens. Opt-in
+    # via compact_prompt until an eval shows it answers as well as the full one
+    SYSTEM_PROMPT_COMPACT = """You answer questions about course materials, using search tools when needed.
+
+Tools (up to 2 sequential calls; make a second call only if the first results are insufficient):
+- get_course_outline: course title, course link and numbered lesson list, for outline/structure questions
+- search_course_content: specific course material; refine with course_name/lesson_number filters
+
+Rules:
+- General knowledge questions: answer directly without tools
+- Outline answers: course title, course link, then every lesson's number and title
+- If tools return nothing, say so without offering alternatives
+- No meta-commentary: never mention searches, tools or your reasoning
+- Be brief, accurate, clear and educational; add an example only when it helps
+"""
+
+    def __init__(
+        self,
+        api_key: str,
+        model: str,
+        max_tool_concurrency: int = 4,
+        compact_prompt: bool = False,
+    ):
         self.client = anthropic.Anthropic(api_key=api_key)
+        self.aclient = anthropic.AsyncAnthropic(api_key=api_key)
         self.model = model
 
+        # One pool shared by every request runs every tool call, bounding
+        # concurrent calls (and so vector store load) process-wide, not just
+        # within a single round
+        self._tool_executor = ThreadPoolExecutor(
+            max_workers=max_tool_concurrency, thread_name_prefix="tool"
+        )
+        self._use_token_efficient_tools = model.startswith("claude-3-7-sonnet")
+
         # Pre-build base API parameters
         self.base_params = {"model": self.model, "temperature": 0, "max_tokens": 800}
 
+        # Static system prompt block, cached server-side so later calls reuse it
+        self.system_prompt = (
+            self.SYSTEM_PROMPT_COMPACT if compact_prompt else self.SYSTEM_PROMPT
+        )
+        self.system_block = {
+            "type": "text",
+            "text": self.system_prompt,
+            "cache_control": CACHE_CONTROL,
+        }
+
+    def prompt_fingerprint(self, tools: List[Dict[str, Any]]) -> str:
+        """
+        Short stable hash of the static prompt prefix (system prompt + tools).
+
+        Logged at startup and reported by /api/health so a deploy's prompt can
+        be identified. It only identifies the prompt: the prefix is below the
+        prompt caching minimum (see CACHE_CONTROL), so there is no cache entry
+        for it to protect yet.
+        """
+        tool_defs = sorted(tools, key=lambda tool: tool["name"])
+        prefix = self.system_prompt + json.dumps(tool_defs, sort_keys=True)
+        return hashlib.sha256(prefix.encode()).hexdigest()[:16]
+
     def generate_response(
         self,
         query: str,
@@ -102,128 +172,400 @@ Provide only the direct answer to what was asked.
             return self._generate_simple_response(query, conversation_history)
 
         # Initialize round context for sequential processing
-        context = RoundContext(
-            original_query=query, conversation_history=conversation_history, tools=tools
-        )
+        context = self._new_context(query, conversation_history, tools)
 
-        # Start recursive processing with maximum 2 rounds
-        return self._process_rounds_recursive(context, tool_manager, max_rounds=2)
+        # Process rounds with a maximum of 2
+        return self._process_rounds(context, tool_manager, max_rounds=2)
 
-    def _generate_simple_response(
-        self, query: str, conversation_history: Optional[str] = None
+    async def agenerate_response(
+        self,
+        query: str,
+        conversation_history: Optional[str] = None,
+        tools: Optional[List] = None,
+        tool_manager=None,
     ) -> str:
-        """Generate simple response without tools"""
-        system_content = (
-            f"{self.SYSTEM_PROMPT}\n\nPrevious conversation:\n{conversation_history}"
-            if conversation_history
-            else self.SYSTEM_PROMPT
+        """
+        Async variant of generate_response using the AsyncAnthropic client.
+
+        API calls are awaited on the event loop; synchronous tools run in
+        worker threads so they never block it.
+        """
+        if not tools or not tool_manager:
+            response = await self.aclient.messages.create(
+                **self._simple_params(query, conversation_history)
+            )
+            return response.content[0].text
+
+        context = self._new_context(query, conversation_history, tools)
+        return await self._aprocess_rounds(context, tool_manager, max_rounds=2)
+
+    def generate_response_stream(
+        self,
+        query: str,
+        conversation_history: Optional[str] = None,
+        tools: Optional[List] = None,
+        tool_manager=None,
+    ) -> Iterator[str]:
+        """
+        Generate an AI response, yielding text deltas as they arrive.
+
+        Follows the same round logic as generate_response, but every call is
+        made with messages.stream so callers (e.g. a StreamingResponse) can
+        show the answer as soon as the first token is generated.
+
+        Text deltas are passed straight through, including any preamble a
+        round writes before it calls a tool (generate_response drops those).
+        A tool_use block can follow text at any point until the message ends,
+        so holding preambles back would mean buffering every tool-enabled
+        round, which is the direct answer or final answer on the common paths.
+        The system prompt forbids meta-commentary, so preambles are rare.
+        """
+        if not tools or not tool_manager:
+            yield from self._stream(self._simple_params(query, conversation_history))
+            return
+
+        context = self._new_context(query, conversation_history, tools)
+        steps = self._round_steps(context, max_rounds=2)
+        try:
+            kind, value = next(steps)
+            while True:
+                if kind == "round":
+                    try:
+                        response = yield from self._stream(value)
+                    except Exception as e:
+                        kind, value = steps.throw(e)
+                        continue
+                    kind, value = steps.send(response)
+                else:
+                    kind, value = steps.send(
+                        self._execute_tools_for_round(value, context, tool_manager)
+                    )
+        except StopIteration as done:
+            kind, value = done.value
+
+        # A "reply" round has already been streamed
+        if kind == "answer":
+            params, error_text = value
+            try:
+                yield from self._stream(params)
+            except Exception:
+                if error_text is None:
+                    raise
+                yield error_text
+        elif kind == "error":
+            yield value
+
+    def _stream(self, api_params: Dict[str, Any]):
+        """Yield text deltas for one streamed API call, returning the final message"""
+        with self.client.messages.stream(**api_params) as stream:
+            yield from stream.text_stream
+            return stream.get_final_message()
+
+    def _new_context(
+        self, query: str, conversation_history: Optional[str], tools: List
+    ) -> RoundContext:
+        """Create the round context shared by every round of one request"""
+        return RoundContext(
+            original_query=query,
+            conversation_history=conversation_history,
+            tools=self._with_cache_breakpoint(tools),
+            base_system=self._build_system(conversation_history),
         )
 
-        api_params = {
+    def _build_system(
+        self, conversation_history: Optional[str]
+    ) -> List[Dict[str, Any]]:
+        """
+        Build system content as a cached static prefix plus conversation history.
+
+        History goes in a separate uncached block after the static prompt so
+        it never invalidates the cached prefix.
+        """
+        system = [self.system_block]
+        if conversation_history:
+            system.append(
+                {
+                    "type": "text",
+                    "text": f"Previous conversation:\n{conversation_history}",
+                }
+            )
+        return system
+
+    @staticmethod
+    def _system_with_note(context: RoundContext, note: str) -> List[Dict[str, Any]]:
+        """Append a per-call note block to the request's precomputed system"""
+        return [*context.base_system, {"type": "text", "text": note}]
+
+    @staticmethod
+    def _with_cache_breakpoint(tools: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Return tools with a cache breakpoint on the last (static) definition"""
+        return [*tools[:-1], {**tools[-1], "cache_control": CACHE_CONTROL}]
+
+    def _simple_params(
+        self, query: str, conversation_history: Optional[str]
+    ) -> Dict[str, Any]:
+        """Build API parameters for a response without tools"""
+        return {
             **self.base_params,
             "messages": [{"role": "user", "content": query}],
-            "system": system_content,
+            "system": self._build_system(conversation_history),
         }
 
-        response = self.client.messages.create(**api_params)
+    def _generate_simple_response(
+        self, query: str, conversation_history: Optional[str] = None
+    ) -> str:
+        """Generate simple response without tools"""
+        response = self.client.messages.create(
+            **self._simple_params(query, conversation_history)
+        )
         return response.content[0].text
 
-    def _process_rounds_recursive(
-        self, context: RoundContext, tool_manager, max_rounds: int = 2
-    ) -> str:
+    def _round_steps(self, context: RoundContext, max_rounds: int = 2):
         """
-        Recursively process rounds until termination condition is met.
-
-        Termination conditions:
-        1. Maximum rounds reached (2)
-        2. Response has no tool_use blocks
-        3. Tool execution fails
+        Run the round loop shared by the sync, async and streaming drivers.
+
+        Yields the next step as (kind, value) and is sent that step's result:
+        - ("round", params): make a tool-enabled call and send the message
+          back, or throw the call's error in
+        - ("tools", response): run the round's tool calls and send the
+          ToolExecutionResult back
+
+        Returns the terminal step once a termination condition is met:
+        1. Maximum rounds reached: ("answer", (params, None)), a final call
+           without tools whose errors propagate
+        2. Response has no tool_use blocks: ("reply", response)
+        3. Tool execution fails: ("answer", (params, error_text)), a final
+           call answered by error_text if it fails as well
+        A failed round call returns ("error", text).
         """
-        context.current_round += 1
-
-        # Termination condition: max rounds reached
-        if context.current_round > max_rounds:
-            return self._handle_max_rounds_reached(context)
+        while True:
+            context.current_round += 1
+
+            # Termination condition: max rounds reached
+            if context.current_round > max_rounds:
+                return "answer", (self._max_rounds_params(context), None)
+
+            # Get response for current round
+            try:
+                response = yield "round", self._round_params(context)
+            except Exception as e:
+                return "error", self._handle_round_error(context, e)
+
+            # Termination condition: no tool use
+            if response.stop_reason != "tool_use":
+                return "reply", response
+
+            # Process tool calls before the next round
+            tool_execution_result = yield "tools", response
+
+            # Termination condition: tool execution failed
+            if tool_execution_result.failed:
+                return "answer", (
+                    self._fallback_params(tool_execution_result, context),
+                    f"I encountered an error while processing your request: {tool_execution_result.error_message}",
+                )
+
+            # Update context with tool results for the next round
+            self._update_context_with_tool_results(
+                context, response, tool_execution_result
+            )
 
-        # Get response for current round
+    def _process_rounds(
+        self, context: RoundContext, tool_manager, max_rounds: int = 2
+    ) -> str:
+        """Drive _round_steps with blocking API calls and return the answer"""
+        steps = self._round_steps(context, max_rounds)
         try:
-            response = self._execute_round(context)
-        except Exception as e:
-            return self._handle_round_error(context, e)
-
-        # Termination condition: no tool use
-        if response.stop_reason != "tool_use":
-            return self._extract_final_response(response)
-
-        # Process tool calls and continue recursively
-        tool_execution_result = self._execute_tools_for_round(
-            response, context, tool_manager
-        )
-
-        # Termination condition: tool execution failed
-        if tool_execution_result.failed:
-            return self._handle_tool_execution_failure(tool_execution_result, context)
+            kind, value = next(steps)
+            while True:
+                if kind == "round":
+                    try:
+                        response = self.client.messages.create(**value)
+                    except Exception as e:
+                        kind, value = steps.throw(e)
+                        continue
+                    kind, value = steps.send(response)
+                else:
+                    kind, value = steps.send(
+                        self._execute_tools_for_round(value, context, tool_manager)
+                    )
+        except StopIteration as done:
+            kind, value = done.value
 
-        # Update context with tool results and recurse
-        self._update_context_with_tool_results(context, response, tool_execution_result)
+        if kind == "reply":
+            return self._extract_final_response(value)
+        if kind == "answer":
+            return self._final_answer(*value)
+        return value
 
-        # Recursive call for next round
-        return self._process_rounds_recursive(context, tool_manager, max_rounds)
+    async def _aprocess_rounds(
+        self, context: RoundContext, tool_manager, max_rounds: int = 2
+    ) -> str:
+        """Async counterpart of _process_rounds, driving the same round loop"""
+        steps = self._round_steps(context, max_rounds)
+        try:
+            kind, value = next(steps)
+            while True:
+                if kind == "round":
+                    try:
+                        response = await self.aclient.messages.create(**value)
+                    except Exception as e:
+                        kind, value = steps.throw(e)
+                        continue
+                    kind, value = steps.send(response)
+                else:
+                    kind, value = steps.send(
+                        await self._aexecute_tools_for_round(
+                            value, context, tool_manager
+                        )
+                    )
+        except StopIteration as done:
+            kind, value = done.value
 
-    def _execute_round(self, context: RoundContext):
-        """Execute a single round of AI interaction"""
-        system_content = (
-            f"{self.SYSTEM_PROMPT}\n\nPrevious conversation:\n{context.conversation_history}"
-            if context.conversation_history
-            else self.SYSTEM_PROMPT
-        )
+        if kind == "reply":
+            return self._extract_final_response(value)
+        if kind == "answer":
+            return await self._afinal_answer(*value)
+        return value
 
+    def _round_params(self, context: RoundContext) -> Dict[str, Any]:
+        """Build API parameters for the current tool-enabled round"""
         # Add round-specific guidance for subsequent rounds
+        system = context.base_system
         if context.current_round > 1:
-            system_content += f"\n\nThis is round {context.current_round} of up to 2 rounds. Consider if additional tool calls would improve your answer based on previous results."
+            system = self._system_with_note(
+                context,
+                f"This is round {context.current_round} of up to 2 rounds. Consider if additional tool calls would improve your answer based on previous results.",
+            )
 
         api_params = {
             **self.base_params,
-            "messages": context.messages.copy(),
-            "system": system_content,
+            "messages": context.messages,
+            "system": system,
             "tools": context.tools,
             "tool_choice": {"type": "auto"},
         }
-
-        return self.client.messages.create(**api_params)
+        if self._use_token_efficient_tools:
+            api_params["extra_headers"] = TOKEN_EFFICIENT_TOOLS_HEADER
+        return api_params
+
+    @staticmethod
+    def _partition_tool_blocks(response, tool_manager):
+        """Split a response's tool_use blocks into read-only and mutating indexes"""
+        tool_blocks = [b for b in response.content if b.type == "tool_use"]
+        read_only, mutating = [], []
+        for i, block in enumerate(tool_blocks):
+            if tool_manager.is_read_only(block.name):
+                read_only.append(i)
+            else:
+                mutating.append(i)
+        return tool_blocks, read_only, mutating
 
     def _execute_tools_for_round(
         self, response, context: RoundContext, tool_manager
     ) -> ToolExecutionResult:
-        """Execute all tool calls for the current round"""
-        result = ToolExecutionResult()
+        """Execute all tool calls for the current round, concurrently when possible"""
+        tool_blocks, read_only, mutating = self._partition_tool_blocks(
+            response, tool_manager
+        )
+        outcomes = [None] * len(tool_blocks)
 
-        for content_block in response.content:
-            if content_block.type == "tool_use":
-                try:
-                    tool_result = tool_manager.execute_tool(
-                        content_block.name, **content_block.input
-                    )
+        # Fan out read-only tool calls so the round costs max(latency), not the sum
+        futures = {
+            i: self._submit_tool(tool_manager, tool_blocks[i]) for i in read_only
+        }
+        for i, future in futures.items():
+            outcomes[i] = future.result()
 
-                    result.tool_results.append(
-                        {
-                            "type": "tool_result",
-                            "tool_use_id": content_block.id,
-                            "content": tool_result,
-                        }
-                    )
-                    result.executed_tools.append(content_block.name)
+        # Tools with side effects run one at a time so they cannot race. A failed
+        # call discards the round, so later side effects are skipped
+        for i in mutating:
+            if self._first_error(outcomes) is not None:
+                break
+            outcomes[i] = self._submit_tool(tool_manager, tool_blocks[i]).result()
 
-                except Exception as e:
-                    result.failed = True
-                    result.error_message = f"Tool execution failed: {str(e)}"
-                    context.errors.append(
-                        f"Round {context.current_round}: {result.error_message}"
-                    )
-                    break
+        return self._collect_tool_results(tool_blocks, outcomes, context)
+
+    async def _aexecute_tools_for_round(
+        self, response, context: RoundContext, tool_manager
+    ) -> ToolExecutionResult:
+        """Execute a round's tool calls in the tool pool without blocking the loop"""
+        tool_blocks, read_only, mutating = self._partition_tool_blocks(
+            response, tool_manager
+        )
+        outcomes = [None] * len(tool_blocks)
+
+        results = await asyncio.gather(
+            *(
+                asyncio.wrap_future(self._submit_tool(tool_manager, tool_blocks[i]))
+                for i in read_only
+            )
+        )
+        for i, outcome in zip(read_only, results):
+            outcomes[i] = outcome
+
+        for i in mutating:
+            if self._first_error(outcomes) is not None:
+                break
+            outcomes[i] = await asyncio.wrap_future(
+                self._submit_tool(tool_manager, tool_blocks[i])
+            )
+
+        return self._collect_tool_results(tool_blocks, outcomes, context)
+
+    @staticmethod
+    def _collect_tool_results(
+        tool_blocks, outcomes, context: RoundContext
+    ) -> ToolExecutionResult:
+        """Build tool_result blocks in block order, or report the first error"""
+        result = ToolExecutionResult()
+
+        error = AIGenerator._first_error(outcomes)
+        if error is not None:
+            result.failed = True
+            result.error_message = f"Tool execution failed: {str(error)}"
+            context.errors.append(
+                f"Round {context.current_round}: {result.error_message}"
+            )
+            return result
+
+        # Results are collected in block order so each tool_use_id lines up
+        for block, (tool_result, _) in zip(tool_blocks, outcomes):
+            result.tool_results.append(
+                {
+                    "type": "tool_result",
+                    "tool_use_id": block.id,
+                    "content": tool_result,
+                }
+            )
+            result.executed_tools.append(block.name)
 
         return result
 
+    def _submit_tool(self, tool_manager, block) -> Future:
+        """Queue a tool call on the shared pool, returning a future of (result, error)"""
+        # Each call runs in a copy of this context so per-request state such as
+        # collected sources follows the tool call onto the worker thread
+        return self._tool_executor.submit(
+            contextvars.copy_context().run, self._run_tool, tool_manager, block
+        )
+
+    @staticmethod
+    def _first_error(outcomes) -> Optional[Exception]:
+        """Return the first error among executed tool calls, in block order"""
+        for outcome in outcomes:
+            if outcome is not None and outcome[1] is not None:
+                return outcome[1]
+        return None
+
+    @staticmethod
+    def _run_tool(tool_manager, block):
+        """Execute a single tool_use block, returning (result, error)"""
+        try:
+            return tool_manager.execute_tool(block.name, **block.input), None
+        except Exception as e:
+            return None, e
+
     def _update_context_with_tool_results(
         self, context: RoundContext, response, tool_result: ToolExecutionResult
     ):
@@ -237,50 +579,61 @@ Provide only the direct answer to what was asked.
                 {"role": "user", "content": tool_result.tool_results}
             )
 
-    def _handle_max_rounds_reached(self, context: RoundContext) -> str:
-        """Handle case where maximum rounds are reached"""
-        system_content = (
-            f"{self.SYSTEM_PROMPT}\n\nPrevious conversation:\n{context.conversation_history}"
-            if context.conversation_history
-            else self.SYSTEM_PROMPT
-        )
-        system_content += (
-            "\n\nProvide your final answer based on the tool results above."
-        )
-
-        final_params = {
+    def _max_rounds_params(self, context: RoundContext) -> Dict[str, Any]:
+        """Build API parameters for the final answer after the last round"""
+        # Tools must stay defined while the history holds tool_use blocks;
+        # tool_choice "none" forces a text answer and keeps the cached prefix
+        return {
             **self.base_params,
             "messages": context.messages,
-            "system": system_content,
+            "system": self._system_with_note(
+                context,
+                "Provide your final answer based on the tool results above.",
+            ),
+            "tools": context.tools,
+            "tool_choice": {"type": "none"},
         }
 
-        final_response = self.client.messages.create(**final_params)
-        return final_response.content[0].text
-
-    def _handle_tool_execution_failure(
+    def _fallback_params(
         self, tool_result: ToolExecutionResult, context: RoundContext
-    ) -> str:
-        """Handle tool execution failures gracefully"""
+    ) -> Dict[str, Any]:
+        """Build API parameters for a best-effort answer after a tool failure"""
         error_context = f"Tool execution failed in round {context.current_round}: {tool_result.error_message}"
 
-        system_content = (
-            f"{self.SYSTEM_PROMPT}\n\nPrevious conversation:\n{context.conversation_history}"
-            if context.conversation_history
-            else self.SYSTEM_PROMPT
-        )
-        system_content += f"\n\nNote: {error_context}. Please provide the best answer you can based on available information."
-
-        fallback_params = {
+        return {
             **self.base_params,
             "messages": context.messages,
-            "system": system_content,
+            "system": self._system_with_note(
+                context,
+                f"Note: {error_context}. Please provide the best answer you can based on available information.",
+            ),
+            "tools": context.tools,
+            "tool_choice": {"type": "none"},
         }
 
+    def _final_answer(
+        self, api_params: Dict[str, Any], error_text: Optional[str]
+    ) -> str:
+        """Make a terminal call without tools; error_text answers if it fails"""
         try:
-            fallback_response = self.client.messages.create(**fallback_params)
-            return fallback_response.content[0].text
-        except Exception as e:
-            return f"I encountered an error while processing your request: {tool_result.error_message}"
+            final_response = self.client.messages.create(**api_params)
+            return final_response.content[0].text
+        except Exception:
+            if error_text is None:
+                raise
+            return error_text
+
+    async def _afinal_answer(
+        self, api_params: Dict[str, Any], error_text: Optional[str]
+    ) -> str:
+        """Async counterpart of _final_answer"""
+        try:
+            final_response = await self.aclient.messages.create(**api_params)
+            return final_response.content[0].text
+        except Exception:
+            if error_text is None:
+                raise
+            return error_text
 
     def _handle_round_error(self, context: RoundContext, error: Exception) -> str:
         """Handle errors during round execution"""
@@ -2,13 +2,15 @@ import warnings
 
 warnings.filterwarnings("ignore", message="resource_tracker: There appear to be.*")
 
+import json
 import os
-from typing import List, Optional
+from typing import Any, Dict, Iterator, List, Optional
 
 from config import config
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from rag_system import RAGSystem
@@ -63,6 +65,13 @@ class CourseStats(BaseModel):
     course_titles: List[str]
 
 
+class HealthStatus(BaseModel):
+    """Response model for health checks"""
+
+    status: str
+    prompt_fingerprint: str
+
+
 # API Endpoints
 
 
@@ -76,7 +85,7 @@ async def query_documents(request: QueryRequest):
             session_id = rag_system.session_manager.create_session()
 
         # Process query using RAG system
-        answer, sources = rag_system.query(request.query, session_id)
+        answer, sources = await rag_system.aquery(request.query, session_id)
 
         # Convert sources to Source objects
         source_objects = []
@@ -95,6 +104,44 @@ async def query_documents(request: QueryRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _ndjson(event: Dict[str, Any]) -> bytes:
+    """Encode one streamed event as a line of JSON"""
+    return json.dumps(event).encode() + b"\n"
+
+
+def _query_events(chunks, session_id: str) -> Iterator[bytes]:
+    """Stream answer deltas, then the sources once the answer is complete"""
+    try:
+        while True:
+            yield _ndjson({"type": "delta", "text": next(chunks)})
+    except StopIteration as done:
+        sources = [
+            source if isinstance(source, dict) else {"text": source, "link": None}
+            for source in done.value
+        ]
+        yield _ndjson({"type": "done", "sources": sources, "session_id": session_id})
+    except Exception as e:
+        # Headers are already sent, so the error travels as the last event
+        yield _ndjson({"type": "error", "detail": str(e)})
+
+
+@app.post("/api/query/stream")
+async def query_documents_stream(request: QueryRequest):
+    """Process a query, streaming the answer as newline-delimited JSON events
+
+    Each line is a {"type": "delta", "text": ...} event, followed by one
+    {"type": "done", "sources": [...], "session_id": ...} event.
+    """
+    session_id = request.session_id
+    if not session_id:
+        session_id = rag_system.session_manager.create_session()
+
+    chunks = rag_system.query_stream(request.query, session_id)
+    return StreamingResponse(
+        _query_events(chunks, session_id), media_type="application/x-ndjson"
+    )
+
+
 @app.get("/api/courses", response_model=CourseStats)
 async def get_course_stats():
     """Get course analytics and statistics"""
@@ -108,6 +155,12 @@ async def get_course_stats():
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/api/health", response_model=HealthStatus)
+async def health():
+    """Report liveness and the fingerprint identifying the prompt in use"""
+    return HealthStatus(status="ok", prompt_fingerprint=rag_system.prompt_fingerprint)
+
+
 @app.delete("/api/sessions/{session_id}/clear")
 async def clear_session(session_id: str):
     """Clear conversation history for a specific session"""
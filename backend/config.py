@@ -24,6 +24,9 @@ class Config:
     MAX_RESULTS: int = 5  # Maximum search results to return
     MAX_HISTORY: int = 2  # Number of conversation messages to remember
 
+    # Tool calls allowed to run at once across all requests (bounds Chroma load)
+    TOOL_MAX_CONCURRENCY: int = int(os.getenv("TOOL_MAX_CONCURRENCY", "4"))
+
     # Database paths
     CHROMA_PATH: str = "./chroma_db"  # ChromaDB storage location
 
@@ -1,5 +1,6 @@
+import contextvars
 import os
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Generator, List, Optional, Tuple
 
 from ai_generator import AIGenerator
 from document_processor import DocumentProcessor
@@ -23,7 +24,9 @@ class RAGSystem:
             config.CHROMA_PATH, config.EMBEDDING_MODEL, config.MAX_RESULTS
         )
         self.ai_generator = AIGenerator(
-            config.ANTHROPIC_API_KEY, config.ANTHROPIC_MODEL
+            config.ANTHROPIC_API_KEY,
+            config.ANTHROPIC_MODEL,
+            config.TOOL_MAX_CONCURRENCY,
         )
         self.session_manager = SessionManager(config.MAX_HISTORY)
 
@@ -34,6 +37,12 @@ class RAGSystem:
         self.tool_manager.register_tool(self.search_tool)
         self.tool_manager.register_tool(self.outline_tool)
 
+        # Identifies the system prompt and tool definitions in use
+        self.prompt_fingerprint = self.ai_generator.prompt_fingerprint(
+            self.tool_manager.get_tool_definitions()
+        )
+        print(f"Prompt fingerprint: {self.prompt_fingerprint}")
+
     def add_course_document(self, file_path: str) -> Tuple[Course, int]:
         """
         Add a single course document to the knowledge base.
@@ -55,6 +64,7 @@ class RAGSystem:
 
             # Add course content chunks to vector store
             self.vector_store.add_course_content(course_chunks)
+            self.outline_tool.invalidate(course.title)
 
             return course, len(course_chunks)
         except Exception as e:
@@ -117,6 +127,10 @@ class RAGSystem:
                 except Exception as e:
                     print(f"Error processing {file_name}: {e}")
 
+        # Outlines cached before this load may describe replaced courses
+        if clear_existing or total_courses:
+            self.outline_tool.invalidate()
+
         return total_courses, total_chunks
 
     def query(
@@ -132,6 +146,57 @@ class RAGSystem:
         Returns:
             Tuple of (response, sources list - empty for tool-based approach)
         """
+        # Generate response using AI with tools, collecting sources they return
+        with self.tool_manager.collect_sources() as sources:
+            response = self.ai_generator.generate_response(
+                **self._generation_kwargs(query, session_id)
+            )
+        return response, self._finish_query(query, session_id, response, sources)
+
+    async def aquery(
+        self, query: str, session_id: Optional[str] = None
+    ) -> Tuple[str, List[str]]:
+        """Async variant of query that awaits the AI generator's async client"""
+        with self.tool_manager.collect_sources() as sources:
+            response = await self.ai_generator.agenerate_response(
+                **self._generation_kwargs(query, session_id)
+            )
+        return response, self._finish_query(query, session_id, response, sources)
+
+    def query_stream(
+        self, query: str, session_id: Optional[str] = None
+    ) -> Generator[str, None, List[Dict]]:
+        """
+        Streaming variant of query, yielding answer text deltas as they arrive.
+
+        The deduped sources are the generator's return value. Every step runs
+        in one copied context, so the source collector survives a
+        StreamingResponse advancing the generator from different threads.
+        """
+        context = contextvars.copy_context()
+        chunks = self._stream_query(query, session_id)
+        while True:
+            try:
+                text = context.run(next, chunks)
+            except StopIteration as done:
+                return done.value
+            yield text
+
+    def _stream_query(
+        self, query: str, session_id: Optional[str]
+    ) -> Generator[str, None, List[Dict]]:
+        """Stream the answer, then record the full exchange once it is complete"""
+        parts = []
+        with self.tool_manager.collect_sources() as sources:
+            for text in self.ai_generator.generate_response_stream(
+                **self._generation_kwargs(query, session_id)
+            ):
+                parts.append(text)
+                yield text
+        return self._finish_query(query, session_id, "".join(parts), sources)
+
+    def _generation_kwargs(self, query: str, session_id: Optional[str]) -> Dict:
+        """Build the AI generator arguments for a user query"""
         # Create prompt for the AI with clear instructions
         prompt = f"""Answer this question about course materials: {query}"""
 
@@ -140,26 +205,24 @@ class RAGSystem:
         if session_id:
             history = self.session_manager.get_conversation_history(session_id)
 
-        # Generate response using AI with tools
-        response = self.ai_generator.generate_response(
-            query=prompt,
-            conversation_history=history,
-            tools=self.tool_manager.get_tool_definitions(),
-            tool_manager=self.tool_manager,
-        )
-
-        # Get sources from the search tool
-        sources = self.tool_manager.get_last_sources()
-
-        # Reset sources after retrieving them
-        self.tool_manager.reset_sources()
+        return {
+            "query": prompt,
+            "conversation_history": history,
+            "tools": self.tool_manager.get_tool_definitions(),
+            "tool_manager": self.tool_manager,
+        }
 
+    def _finish_query(
+        self, query: str, session_id: Optional[str], response: str, sources: List
+    ) -> List[Dict]:
+        """Record the exchange and dedupe sources once a response is generated"""
         # Update conversation history
         if session_id:
             self.session_manager.add_exchange(session_id, query, response)
 
-        # Return response with sources from tool searches
-        return response, sources
+        # Several searches may cite the same lesson; dedupe in first-seen order
+        unique = {(source["text"], source["link"]): source for source in sources}
+        return list(unique.values())
 
     def get_course_analytics(self) -> Dict:
         """Get analytics about the course catalog"""
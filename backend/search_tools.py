@@ -1,19 +1,39 @@
+import json
 from abc import ABC, abstractmethod
-from typing import Any, Dict, Optional, Protocol
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Protocol, Union
 
 from vector_store import SearchResults, VectorStore
 
+# Sources recorded by tool calls within the current collect_sources() block
+_collected_sources: ContextVar[Optional[List[Dict[str, Any]]]] = ContextVar(
+    "collected_sources", default=None
+)
+
+
+@dataclass
+class ToolOutput:
+    """Tool result text for the AI plus the sources it was built from"""
+
+    text: str
+    sources: List[Dict[str, Any]] = field(default_factory=list)
+
 
 class Tool(ABC):
     """Abstract base class for all tools"""
 
+    # Read-only tools have no side effects and may run concurrently
+    is_read_only: bool = True
+
     @abstractmethod
     def get_tool_definition(self) -> Dict[str, Any]:
         """Return Anthropic tool definition for this tool"""
         pass
 
     @abstractmethod
-    def execute(self, **kwargs) -> str:
+    def execute(self, **kwargs) -> Union[str, ToolOutput]:
         """Execute the tool with given parameters"""
         pass
 
@@ -21,41 +41,45 @@ class Tool(ABC):
 class CourseSearchTool(Tool):
     """Tool for searching course content with semantic course name matching"""
 
+    is_read_only = True
+
+    # The schema has no per-instance state, so every call shares one dict
+    _TOOL_DEFINITION: Dict[str, Any] = {
+        "name": "search_course_content",
+        "description": "Search course materials with smart course name matching and lesson filtering",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "query": {
+                    "type": "string",
+                    "description": "What to search for in the course content",
+                },
+                "course_name": {
+                    "type": "string",
+                    "description": "Course title (partial matches work, e.g. 'MCP', 'Introduction')",
+                },
+                "lesson_number": {
+                    "type": "integer",
+                    "description": "Specific lesson number to search within (e.g. 1, 2, 3)",
+                },
+            },
+            "required": ["query"],
+        },
+    }
+
     def __init__(self, vector_store: VectorStore):
         self.store = vector_store
-        self.last_sources = []  # Track sources from last search
 
     def get_tool_definition(self) -> Dict[str, Any]:
         """Return Anthropic tool definition for this tool"""
-        return {
-            "name": "search_course_content",
-            "description": "Search course materials with smart course name matching and lesson filtering",
-            "input_schema": {
-                "type": "object",
-                "properties": {
-                    "query": {
-                        "type": "string",
-                        "description": "What to search for in the course content",
-                    },
-                    "course_name": {
-                        "type": "string",
-                        "description": "Course title (partial matches work, e.g. 'MCP', 'Introduction')",
-                    },
-                    "lesson_number": {
-                        "type": "integer",
-                        "description": "Specific lesson number to search within (e.g. 1, 2, 3)",
-                    },
-                },
-                "required": ["query"],
-            },
-        }
+        return self._TOOL_DEFINITION
 
     def execute(
         self,
         query: str,
         course_name: Optional[str] = None,
         lesson_number: Optional[int] = None,
-    ) -> str:
+    ) -> ToolOutput:
         """
         Execute the search tool with given parameters.
 
@@ -65,7 +89,7 @@ class CourseSearchTool(Tool):
             lesson_number: Optional lesson filter
 
         Returns:
-            Formatted search results or error message
+            Formatted search results with their sources, or an error message
         """
 
         # Use the vector store's unified search interface
@@ -75,7 +99,7 @@ class CourseSearchTool(Tool):
 
         # Handle errors
         if results.error:
-            return results.error
+            return ToolOutput(results.error)
 
         # Handle empty results
         if results.is_empty():
@@ -84,31 +108,24 @@ class CourseSearchTool(Tool):
                 filter_info += f" in course '{course_name}'"
             if lesson_number:
                 filter_info += f" in lesson {lesson_number}"
-            return f"No relevant content found{filter_info}."
+            return ToolOutput(f"No relevant content found{filter_info}.")
 
         # Format and return results
         return self._format_results(results)
 
-    def _format_results(self, results: SearchResults) -> str:
+    def _format_results(self, results: SearchResults) -> ToolOutput:
         """Format search results with course and lesson context"""
         formatted = []
-        sources_dict = {}  # Track unique sources by key
+        sources_dict = {}  # Track unique sources by (course, lesson)
 
         for doc, meta in zip(results.documents, results.metadata):
             course_title = meta.get("course_title", "unknown")
             lesson_num = meta.get("lesson_number")
+            source_key = (course_title, lesson_num)
 
-            # Build context header
-            header = f"[{course_title}"
-            if lesson_num is not None:
-                header += f" - Lesson {lesson_num}"
-            header += "]"
-
-            # Create unique key for deduplication
-            source_key = f"{course_title}|{lesson_num}"
-
-            # Only add source if we haven't seen this course+lesson combo
-            if source_key not in sources_dict:
+            # Build the label and look up the link once per course+lesson combo
+            source = sources_dict.get(source_key)
+            if source is None:
                 source_text = course_title
                 if lesson_num is not None:
                     source_text += f" - Lesson {lesson_num}"
@@ -118,39 +135,55 @@ class CourseSearchTool(Tool):
                 if lesson_num is not None:
                     lesson_link = self.store.get_lesson_link(course_title, lesson_num)
 
-                # Create source object with text and link
-                sources_dict[source_key] = {"text": source_text, "link": lesson_link}
-
-            formatted.append(f"{header}\n{doc}")
+                source = {"text": source_text, "link": lesson_link}
+                sources_dict[source_key] = source
 
-        # Convert dict values to list for storage
-        self.last_sources = list(sources_dict.values())
+            # The context header reuses the source label
+            formatted.append(f"[{source['text']}]\n{doc}")
 
-        return "\n\n".join(formatted)
+        return ToolOutput("\n\n".join(formatted), list(sources_dict.values()))
 
 
 class CourseOutlineTool(Tool):
     """Tool for getting course outlines with complete lesson lists"""
 
+    is_read_only = True
+
+    _TOOL_DEFINITION: Dict[str, Any] = {
+        "name": "get_course_outline",
+        "description": "Get the complete outline and lesson list for a specific course",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "course_title": {
+                    "type": "string",
+                    "description": "Course title or partial title (e.g. 'MCP', 'RAG', 'Chroma')",
+                }
+            },
+            "required": ["course_title"],
+        },
+    }
+
     def __init__(self, vector_store: VectorStore):
         self.store = vector_store
+        # Formatted outlines by resolved title; metadata only changes on ingestion
+        self._outline_cache: Dict[str, str] = {}
+
+    def invalidate(self, title: Optional[str] = None):
+        """
+        Drop cached outlines after the course catalog changes.
+
+        Args:
+            title: Course whose outline changed; all outlines are dropped if omitted
+        """
+        if title is None:
+            self._outline_cache.clear()
+        else:
+            self._outline_cache.pop(title, None)
 
     def get_tool_definition(self) -> Dict[str, Any]:
         """Return Anthropic tool definition for this tool"""
-        return {
-            "name": "get_course_outline",
-            "description": "Get the complete outline and lesson list for a specific course",
-            "input_schema": {
-                "type": "object",
-                "properties": {
-                    "course_title": {
-                        "type": "string",
-                        "description": "Course title or partial title (e.g. 'MCP', 'RAG', 'Chroma')",
-                    }
-                },
-                "required": ["course_title"],
-            },
-        }
+        return self._TOOL_DEFINITION
 
     def execute(self, course_title: str) -> str:
         """
@@ -162,11 +195,17 @@ class CourseOutlineTool(Tool):
         Returns:
             Formatted course outline with lessons or error message
         """
-        # Step 1: Resolve course name using vector search
-        resolved_title = self.store._resolve_course_name(course_title)
+        # Step 1: Resolve course name using vector search, memoized by the store.
+        # The embedding model is uncased, so lowercasing the key does not change
+        # the match and lets differently cased titles share a cache entry
+        resolved_title = self.store._resolve_course_name(course_title.strip().lower())
         if not resolved_title:
             return f"No course found matching '{course_title}'"
 
+        cached = self._outline_cache.get(resolved_title)
+        if cached is not None:
+            return cached
+
         # Step 2: Get course metadata from catalog
         try:
             results = self.store.course_catalog.get(ids=[resolved_title])
@@ -176,11 +215,9 @@ class CourseOutlineTool(Tool):
             metadata = results["metadatas"][0]
 
             # Step 3: Parse and format the course outline
-            import json
-
             course_link = metadata.get("course_link", "No link available")
             lessons_json = metadata.get("lessons_json", "[]")
-            lessons = json.loads(lessons_json)
+            lessons = json.loads(lessons_json) if lessons_json != "[]" else []
 
             # Format the response
             formatted_outline = [
@@ -197,7 +234,9 @@ class CourseOutlineTool(Tool):
             else:
                 formatted_outline.append("  No lessons found")
 
-            return "\n".join(formatted_outline)
+            outline = "\n".join(formatted_outline)
+            self._outline_cache[resolved_title] = outline
+            return outline
 
         except Exception as e:
             return f"Error retrieving course outline: {str(e)}"
@@ -208,6 +247,7 @@ class ToolManager:
 
     def __init__(self):
         self.tools = {}
+        self._defs_cache: Optional[list] = None
 
     def register_tool(self, tool: Tool):
         """Register any tool that implements the Tool interface"""
@@ -216,28 +256,49 @@ class ToolManager:
         if not tool_name:
             raise ValueError("Tool must have a 'name' in its definition")
         self.tools[tool_name] = tool
+        self._defs_cache = None
 
     def get_tool_definitions(self) -> list:
         """Get all tool definitions for Anthropic tool calling"""
-        return [tool.get_tool_definition() for tool in self.tools.values()]
+        # Definitions are static once registered; callers must not mutate them
+        if self._defs_cache is None:
+            self._defs_cache = [
+                tool.get_tool_definition() for tool in self.tools.values()
+            ]
+        return self._defs_cache
+
+    def is_read_only(self, tool_name: str) -> bool:
+        """Check whether a tool can safely run concurrently with other tools"""
+        tool = self.tools.get(tool_name)
+        # Unknown tools only produce a "not found" message, which is side-effect free
+        return tool is None or tool.is_read_only
 
     def execute_tool(self, tool_name: str, **kwargs) -> str:
-        """Execute a tool by name with given parameters"""
+        """Execute a tool by name, recording any sources it returns"""
         if tool_name not in self.tools:
             return f"Tool '{tool_name}' not found"
 
-        return self.tools[tool_name].execute(**kwargs)
-
-    def get_last_sources(self) -> list:
-        """Get sources from the last search operation"""
-        # Check all tools for last_sources attribute
-        for tool in self.tools.values():
-            if hasattr(tool, "last_sources") and tool.last_sources:
-                return tool.last_sources
-        return []
-
-    def reset_sources(self):
-        """Reset sources from all tools that track sources"""
-        for tool in self.tools.values():
-            if hasattr(tool, "last_sources"):
-                tool.last_sources = []
+        result = self.tools[tool_name].execute(**kwargs)
+        if not isinstance(result, ToolOutput):
+            return result
+
+        sources = _collected_sources.get()
+        if sources is not None:
+            sources.extend(result.sources)
+        return result.text
+
+    @contextmanager
+    def collect_sources(self) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Collect sources from tool calls made within this block.
+
+        The collector lives in a ContextVar, so concurrent requests each see
+        their own list; worker threads must run in a copy of the caller's
+        context (asyncio.to_thread does this automatically).
+        """
+        sources: List[Dict[str, Any]] = []
+        token = _collected_sources.set(sources)
+        try:
+            yield sources
+        finally:
+            _collected_sources.reset(token)
@@ -2,25 +2,121 @@
 Test fixtures and utilities for RAG system tests.
 """
 
-import os
 import asyncio
-import sys
-import tempfile
-import shutil
-from typing import Any, Dict, List
-from unittest.mock import MagicMock, Mock, patch
-from fastapi.testclient import TestClient
-
+import json
+from dataclasses import dataclass
+from functools import lru_cache
+from types import MappingProxyType, SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+from unittest.mock import AsyncMock, MagicMock, Mock, patch
+
+import anthropic
 import pytest
-
-# Add backend directory to path so we can import modules
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from chromadb.api.models.Collection import Collection
+from pydantic import BaseModel, TypeAdapter
 
 from models import Course, CourseChunk, Lesson
-from vector_store import SearchResults
+from rag_system import RAGSystem
+from session_manager import SessionManager
+from vector_store import SearchResults, VectorStore
 
+# uvloop is optional (it does not support Windows); when present it makes
+# the event loop behind TestClient and the async tests cheaper to drive
+try:
+    import uvloop
+except ImportError:
+    pass
+else:
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
 
-@pytest.fixture
+# orjson is optional too; when present the test app encodes and the tests
+# decode response bodies with it instead of the stdlib json module
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Lightweight stand-ins for Anthropic response objects; Mock is reserved
+# for collaborators whose calls the tests assert on
+
+
+@dataclass(frozen=True)
+class FakeContent:
+    """Text content block of a Claude response"""
+
+    text: str
+    type: str = "text"
+
+
+@dataclass(frozen=True)
+class FakeToolUse:
+    """tool_use content block of a Claude response"""
+
+    name: str
+    input: Dict[str, Any]
+    id: str
+    type: str = "tool_use"
+
+
+@dataclass(frozen=True)
+class FakeResponse:
+    """Claude messages.create response"""
+
+    stop_reason: str
+    content: Tuple[Any, ...]
+
+
+# Fixed search result shapes, built once at import and returned as-is by
+# the session fixtures below
+_SAMPLE_SEARCH_RESULTS = SearchResults(
+    documents=[
+        "RAG stands for Retrieval-Augmented Generation. It combines information retrieval with text generation.",
+        "Vector embeddings are numerical representations of text that capture semantic meaning.",
+    ],
+    metadata=[
+        {
+            "course_title": "Introduction to RAG Systems",
+            "lesson_number": 1,
+            "chunk_index": 0,
+        },
+        {
+            "course_title": "Introduction to RAG Systems",
+            "lesson_number": 2,
+            "chunk_index": 1,
+        },
+    ],
+    distances=[0.1, 0.2],
+)
+
+_EMPTY_SEARCH_RESULTS = SearchResults(documents=[], metadata=[], distances=[])
+
+# Returned by every mock RAG query call; immutable so no test can leak a
+# mutation into the next
+_RAG_SYSTEM_SOURCES = (
+    MappingProxyType(
+        {"text": "Test Course - Lesson 1", "link": "https://example.com/lesson1"}
+    ),
+)
+
+_DIRECT_RESPONSE = FakeResponse(
+    "end_turn", (FakeContent("This is a direct response without tools"),)
+)
+
+
+# Fixture scopes and parallel safety (under pytest-xdist every worker builds
+# its own session fixtures, so nothing here is shared across processes):
+# - data fixtures are session-scoped and shared by every test: treat them as
+#   read-only (query lists and sample_course_chunks are tuples and
+#   api_test_data is a read-only mapping so accidental mutation fails
+#   loudly; sample_course and the chunks are unfrozen pydantic models, so
+#   never assign to their fields)
+# - _mock_rag, test_app and client are session-scoped; _reset_session_mocks
+#   restores _mock_rag after each test so call history never leaks
+# - every other mock fixture is function-scoped and built fresh per test
+
+
+@pytest.fixture(scope="session")
 def sample_course():
     """Sample course data for testing"""
     return Course(
@@ -42,10 +138,10 @@ def sample_course():
     )
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def sample_course_chunks():
-    """Sample course chunks for testing"""
-    return [
+    """Sample course chunks for testing; a tuple, since the list is shared"""
+    return (
         CourseChunk(
             content="RAG stands for Retrieval-Augmented Generation. It combines information retrieval with text generation.",
             course_title="Introduction to RAG Systems",
@@ -64,97 +160,141 @@ def sample_course_chunks():
             lesson_number=2,
             chunk_index=2,
         ),
-    ]
+    )
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def sample_search_results():
     """Sample search results for testing"""
-    return SearchResults(
-        documents=[
-            "RAG stands for Retrieval-Augmented Generation. It combines information retrieval with text generation.",
-            "Vector embeddings are numerical representations of text that capture semantic meaning.",
-        ],
-        metadata=[
-            {
-                "course_title": "Introduction to RAG Systems",
-                "lesson_number": 1,
-                "chunk_index": 0,
-            },
-            {
-                "course_title": "Introduction to RAG Systems",
-                "lesson_number": 2,
-                "chunk_index": 1,
-            },
-        ],
-        distances=[0.1, 0.2],
-    )
+    return _SAMPLE_SEARCH_RESULTS
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def empty_search_results():
     """Empty search results for testing"""
-    return SearchResults(documents=[], metadata=[], distances=[])
+    return _EMPTY_SEARCH_RESULTS
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def error_search_results():
     """Error search results for testing"""
     return SearchResults.empty("Search failed due to connection error")
 
 
-@pytest.fixture
-def mock_vector_store():
-    """Mock vector store for unit testing"""
-    mock = Mock()
-    mock.search.return_value = SearchResults(
-        documents=["Sample content"],
-        metadata=[{"course_title": "Test Course", "lesson_number": 1}],
-        distances=[0.1],
+@pytest.fixture(scope="session")
+def mock_config():
+    """RAGSystem configuration with test values; shared, so treat as read-only"""
+    return SimpleNamespace(
+        CHUNK_SIZE=800,
+        CHUNK_OVERLAP=100,
+        CHROMA_PATH="./test_chroma_db",
+        EMBEDDING_MODEL="all-MiniLM-L6-v2",
+        MAX_RESULTS=5,
+        ANTHROPIC_API_KEY="test-api-key",
+        ANTHROPIC_MODEL="claude-sonnet-4-20250514",
+        MAX_HISTORY=2,
+        TOOL_MAX_CONCURRENCY=4,
     )
+
+
+# Mock fixtures below are deliberately rebuilt per test rather than copied from
+# a session-scoped template: copy.copy shares child mocks (so a test setting
+# mock.search.return_value would leak into the next) and copy.deepcopy is
+# slower than building these small mocks from scratch. mock_vector_store is
+# the exception: it is requested by most tests, so one spec'd instance is
+# reset in place (return values and side effects included) before each test
+
+
+_DEFAULT_STORE_RESULTS = SearchResults(
+    documents=["Sample content"],
+    metadata=[{"course_title": "Test Course", "lesson_number": 1}],
+    distances=[0.1],
+)
+
+
+@pytest.fixture(scope="session")
+def _vector_store_mock():
+    """Single spec'd VectorStore mock reused by mock_vector_store"""
+    mock = Mock(spec=VectorStore)
+    # Collections are instance attributes, so the class spec omits them
+    mock.course_catalog = Mock(spec=Collection)
+    mock.course_content = Mock(spec=Collection)
+    mock.course_lessons = Mock(spec=Collection)
+    return mock
+
+
+@pytest.fixture
+def mock_vector_store(_vector_store_mock):
+    """Mock vector store for unit testing
+
+    search returns one sample result and get_lesson_link returns a fixed
+    lesson URL unless a test overrides them.
+    """
+    mock = _vector_store_mock
+    mock.reset_mock(return_value=True, side_effect=True)
+    mock.search.return_value = _DEFAULT_STORE_RESULTS
     mock.get_lesson_link.return_value = "https://example.com/lesson1"
     return mock
 
 
+class _StubVectorStore:
+    """Plain stand-in for VectorStore; only the last search's arguments are kept"""
+
+    def __init__(self, search_result=None, lesson_link=None):
+        self._search_result = search_result
+        self._lesson_link = lesson_link
+        self.last_search = None
+
+    def search(self, query, course_name=None, lesson_number=None):
+        self.last_search = {
+            "query": query,
+            "course_name": course_name,
+            "lesson_number": lesson_number,
+        }
+        return self._search_result
+
+    def get_lesson_link(self, course_title, lesson_number):
+        return self._lesson_link
+
+
+@pytest.fixture(scope="session")
+def stub_vector_store():
+    """Factory for _StubVectorStore, for tests that need no call history"""
+    return _StubVectorStore
+
+
 @pytest.fixture
 def mock_anthropic_client():
     """Mock Anthropic client for testing AI generator"""
-    mock_client = Mock()
-
-    # Mock response without tool use - fix the text access
-    mock_response_direct = Mock()
-    mock_response_direct.stop_reason = "end_turn"
-    mock_content = Mock()
-    mock_content.text = "This is a direct response without tools"
-    mock_response_direct.content = [mock_content]
-
-    # Mock response with tool use
-    mock_response_tool = Mock()
-    mock_response_tool.stop_reason = "tool_use"
-    mock_tool_use = Mock()
-    mock_tool_use.type = "tool_use"
-    mock_tool_use.name = "search_course_content"
-    mock_tool_use.input = {"query": "test query"}
-    mock_tool_use.id = "tool_123"
-    mock_response_tool.content = [mock_tool_use]
-
-    # Mock final response after tool execution - fix the text access
-    mock_final_response = Mock()
-    mock_final_content = Mock()
-    mock_final_content.text = "This is the final response after tool execution"
-    mock_final_response.content = [mock_final_content]
-
+    # Spec'd on the real client so the SUT resolves messages.create against a
+    # fixed interface. Not a copied template: copy.copy shares child mocks and
+    # their call history between tests
+    mock_client = Mock(spec=anthropic.Anthropic)
+    mock_client.messages = Mock(spec=anthropic.resources.Messages)
     # Default to direct response, can be overridden in individual tests
-    mock_client.messages.create.return_value = mock_response_direct
+    mock_client.messages.create.return_value = _DIRECT_RESPONSE
 
     return mock_client
 
 
+@pytest.fixture
+def anthropic_client():
+    """Client that AIGenerator receives while the test runs"""
+    # Both SDK classes are patched so building a generator constructs no real
+    # HTTP clients. Kept function-scoped and opt-in: ai_generator.anthropic is
+    # the SDK module itself, so a session-wide patch would leave
+    # anthropic.Anthropic a Mock and break the spec'd mocks above
+    with (
+        patch("ai_generator.anthropic.Anthropic") as client_class,
+        patch("ai_generator.anthropic.AsyncAnthropic"),
+    ):
+        yield client_class.return_value
+
+
 @pytest.fixture
 def mock_tool_manager():
     """Mock tool manager for testing"""
-    mock = Mock()
-    mock.get_tool_definitions.return_value = [
+    definitions = [
         {
             "name": "search_course_content",
             "description": "Search course materials",
@@ -165,44 +305,68 @@ def mock_tool_manager():
             },
         }
     ]
-    mock.execute_tool.return_value = "Mock search results content"
-    mock.get_last_sources.return_value = [
-        {"text": "Test Course - Lesson 1", "link": "https://example.com/lesson1"}
-    ]
-    return mock
+    # Only the methods tests configure or assert on are Mocks
+    return SimpleNamespace(
+        get_tool_definitions=lambda: definitions,
+        is_read_only=Mock(return_value=True),
+        execute_tool=Mock(return_value="Mock search results content"),
+    )
 
 
-@pytest.fixture
+CONTENT_QUERIES = (
+    "What is RAG?",
+    "How do vector embeddings work?",
+    "Explain ChromaDB functionality",
+    "What are the main concepts in lesson 1?",
+    "Tell me about the MCP course content",
+)
+
+OUTLINE_QUERIES = (
+    "What lessons are in the RAG course?",
+    "Show me the course outline for MCP",
+    "List all lessons in the Introduction course",
+)
+
+GENERAL_QUERIES = (
+    "What is the weather today?",
+    "How do I install Python?",
+    "What is machine learning?",
+    "Hello, how are you?",
+)
+
+# Single-query arguments parametrized over each query set, so every case
+# is reported (and can be distributed) on its own
+_QUERY_PARAMS = {
+    "content_query": CONTENT_QUERIES,
+    "outline_query": OUTLINE_QUERIES,
+    "general_query": GENERAL_QUERIES,
+    "any_query": CONTENT_QUERIES + OUTLINE_QUERIES + GENERAL_QUERIES,
+}
+
+
+def pytest_generate_tests(metafunc):
+    """Parametrize tests taking one of the _QUERY_PARAMS arguments"""
+    for argname, queries in _QUERY_PARAMS.items():
+        if argname in metafunc.fixturenames:
+            metafunc.parametrize(argname, queries, ids=lambda q: q[:20])
+
+
+@pytest.fixture(scope="session")
 def content_queries():
     """Sample content-related queries that should trigger tool usage"""
-    return [
-        "What is RAG?",
-        "How do vector embeddings work?",
-        "Explain ChromaDB functionality",
-        "What are the main concepts in lesson 1?",
-        "Tell me about the MCP course content",
-    ]
+    return CONTENT_QUERIES
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def outline_queries():
     """Sample outline queries that should trigger course outline tool"""
-    return [
-        "What lessons are in the RAG course?",
-        "Show me the course outline for MCP",
-        "List all lessons in the Introduction course",
-    ]
+    return OUTLINE_QUERIES
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def general_queries():
     """General knowledge queries that shouldn't trigger tools"""
-    return [
-        "What is the weather today?",
-        "How do I install Python?",
-        "What is machine learning?",
-        "Hello, how are you?",
-    ]
+    return GENERAL_QUERIES
 
 
 def assert_tool_called_correctly(
@@ -223,6 +387,12 @@ def assert_search_results_formatted(
         assert f"Lesson {expected_lesson}" in result_text
 
 
+@lru_cache(maxsize=None)
+def _constant_distances(count: int) -> Tuple[float, ...]:
+    """Shared, immutable distance row of the given length"""
+    return (0.1,) * count
+
+
 def create_mock_chroma_results(
     documents: List[str], metadata: List[Dict[str, Any]]
 ) -> Dict:
@@ -230,38 +400,133 @@ def create_mock_chroma_results(
     return {
         "documents": [documents],
         "metadatas": [metadata],
-        "distances": [[0.1] * len(documents)],
+        "distances": [_constant_distances(len(documents))],
     }
 
 
-@pytest.fixture
-def mock_rag_system():
-    """Mock RAG system for API testing"""
-    mock = Mock()
-    mock.query.return_value = (
+class _StubSessionManager:
+    """Plain stand-in for SessionManager; no test asserts on it"""
+
+    def create_session(self):
+        return "test_session_123"
+
+    def clear_session(self, session_id):
+        return None
+
+
+_STUB_SESSION_MANAGER = _StubSessionManager()
+
+
+# Pydantic models (same as main app); defined once so the session-scoped
+# test app below does not redeclare them for every test
+
+
+class QueryRequest(BaseModel):
+    query: str
+    session_id: Optional[str] = None
+
+
+class Source(BaseModel):
+    text: str
+    link: Optional[str] = None
+
+
+class QueryResponse(BaseModel):
+    answer: str
+    sources: List[Source]
+    session_id: str
+
+
+class CourseStats(BaseModel):
+    total_courses: int
+    course_titles: List[str]
+
+
+class HealthStatus(BaseModel):
+    status: str
+    prompt_fingerprint: str
+
+
+_SOURCE_LIST_ADAPTER = TypeAdapter(List[Source])
+
+# Already-validated default sources, accepted by /api/query without
+# re-validation
+_DEFAULT_SOURCE_OBJECTS = (Source(text="Test source", link="https://example.com"),)
+
+
+def _stream_test_response(query, session_id=None):
+    """Default RAGSystem.query_stream: two deltas, then the sources it returns"""
+    yield "Test "
+    yield "response"
+    return [{"text": "Test source", "link": "https://example.com"}]
+
+
+def _configure_mock_rag(mock_rag):
+    """Apply the default return values the RAG-facing tests expect"""
+    mock_rag.query.return_value = (
         "This is a test response about RAG systems.",
-        [{"text": "Test Course - Lesson 1", "link": "https://example.com/lesson1"}]
+        _RAG_SYSTEM_SOURCES,
     )
-    mock.get_course_analytics.return_value = {
-        "total_courses": 2,
-        "course_titles": ["Introduction to RAG", "Advanced AI Concepts"]
+    mock_rag.aquery = AsyncMock(return_value=("Test response", _DEFAULT_SOURCE_OBJECTS))
+    mock_rag.query_stream.side_effect = _stream_test_response
+    mock_rag.get_course_analytics.return_value = {
+        "total_courses": 1,
+        "course_titles": ["Test Course"],
     }
-    mock.session_manager.create_session.return_value = "test_session_123"
-    mock.session_manager.clear_session.return_value = None
-    mock.add_course_folder.return_value = (2, 50)
-    return mock
+    mock_rag.session_manager = _STUB_SESSION_MANAGER
+    mock_rag.add_course_folder.return_value = (2, 50)
+    mock_rag.prompt_fingerprint = "0123456789abcdef"
+    return mock_rag
+
+
+@pytest.fixture(scope="session")
+def _mock_rag():
+    """RAG system mock built once and shared by mock_rag_system and test_app"""
+    # spec'd so attribute access resolves against a fixed interface instead
+    # of creating child mocks on demand; instance attributes set in
+    # RAGSystem.__init__ are supplied by _configure_mock_rag
+    return _configure_mock_rag(Mock(spec=RAGSystem))
 
 
 @pytest.fixture
-def test_app():
+def mock_rag_system(_mock_rag):
+    """Mock RAG system for API testing"""
+    return _mock_rag
+
+
+@pytest.fixture
+def session_manager(_mock_rag):
+    """Real SessionManager installed on the shared RAG mock for one test
+
+    Lets a test observe session state through the session-scoped client
+    without rebuilding the app; _reset_session_mocks puts the stub back.
+    """
+    manager = SessionManager()
+    _mock_rag.session_manager = manager
+    return manager
+
+
+@pytest.fixture(autouse=True)
+def _reset_session_mocks(_mock_rag):
+    """Undo a test's configuration of the session mocks once it finishes"""
+    yield
+    _mock_rag.reset_mock(return_value=True, side_effect=True)
+    _configure_mock_rag(_mock_rag)
+
+
+@pytest.fixture(scope="session")
+def test_app(_mock_rag):
     """Create test FastAPI app without static file mounting"""
+    # FastAPI is imported here so runs that select no API tests never load it
     from fastapi import FastAPI, HTTPException
     from fastapi.middleware.cors import CORSMiddleware
-    from pydantic import BaseModel
-    from typing import List, Optional
+    from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
     
     # Create test app with same endpoints but no static files
-    app = FastAPI(title="Course Materials RAG System Test")
+    app = FastAPI(
+        title="Course Materials RAG System Test",
+        default_response_class=ORJSONResponse if orjson is not None else JSONResponse,
+    )
     
     # Add CORS
     app.add_middleware(
@@ -272,50 +537,31 @@ def test_app():
         allow_headers=["*"],
     )
     
-    # Pydantic models (same as main app)
-    class QueryRequest(BaseModel):
-        query: str
-        session_id: Optional[str] = None
-
-    class Source(BaseModel):
-        text: str
-        link: Optional[str] = None
-
-    class QueryResponse(BaseModel):
-        answer: str
-        sources: List[Source]
-        session_id: str
-
-    class CourseStats(BaseModel):
-        total_courses: int
-        course_titles: List[str]
-    
-    # Mock RAG system for the app
-    mock_rag = Mock()
-    mock_rag.query.return_value = (
-        "Test response",
-        [{"text": "Test source", "link": "https://example.com"}]
-    )
-    mock_rag.get_course_analytics.return_value = {
-        "total_courses": 1,
-        "course_titles": ["Test Course"]
-    }
-    mock_rag.session_manager.create_session.return_value = "test_session_123"
-    mock_rag.session_manager.clear_session.return_value = None
+    mock_rag = _mock_rag
     
     # API endpoints (same as main app)
     @app.post("/api/query", response_model=QueryResponse)
     async def query_documents(request: QueryRequest):
         try:
             session_id = request.session_id or mock_rag.session_manager.create_session()
-            answer, sources = mock_rag.query(request.query, session_id)
+            answer, sources = await mock_rag.aquery(request.query, session_id)
             
-            source_objects = []
-            for source in sources:
-                if isinstance(source, dict):
-                    source_objects.append(Source(**source))
-                else:
-                    source_objects.append(Source(text=source, link=None))
+            if all(type(source) is Source for source in sources):
+                # Pre-typed sources (the mock's default) need no validation
+                source_objects = list(sources)
+            else:
+                # Strings become dicts; everything goes through one batched
+                # validation pass
+                source_objects = _SOURCE_LIST_ADAPTER.validate_python(
+                    [
+                        (
+                            {"text": source, "link": None}
+                            if isinstance(source, str)
+                            else source
+                        )
+                        for source in sources
+                    ]
+                )
             
             return QueryResponse(
                 answer=answer,
@@ -325,6 +571,28 @@ def test_app():
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
 
+    def query_events(chunks, session_id):
+        try:
+            while True:
+                yield json.dumps({"type": "delta", "text": next(chunks)}).encode() + b"\n"
+        except StopIteration as done:
+            sources = [
+                source if isinstance(source, dict) else {"text": source, "link": None}
+                for source in done.value
+            ]
+            event = {"type": "done", "sources": sources, "session_id": session_id}
+            yield json.dumps(event).encode() + b"\n"
+        except Exception as e:
+            yield json.dumps({"type": "error", "detail": str(e)}).encode() + b"\n"
+
+    @app.post("/api/query/stream")
+    async def query_documents_stream(request: QueryRequest):
+        session_id = request.session_id or mock_rag.session_manager.create_session()
+        chunks = mock_rag.query_stream(request.query, session_id)
+        return StreamingResponse(
+            query_events(chunks, session_id), media_type="application/x-ndjson"
+        )
+
     @app.get("/api/courses", response_model=CourseStats)
     async def get_course_stats():
         try:
@@ -336,6 +604,10 @@ def test_app():
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
 
+    @app.get("/api/health", response_model=HealthStatus)
+    async def health():
+        return HealthStatus(status="ok", prompt_fingerprint=mock_rag.prompt_fingerprint)
+
     @app.delete("/api/sessions/{session_id}/clear")
     async def clear_session(session_id: str):
         try:
@@ -351,48 +623,79 @@ def test_app():
     return app
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
+def json_body():
+    """Decode a response body, with orjson when it is installed"""
+    loads = orjson.loads if orjson is not None else json.loads
+
+    def decode(response):
+        return loads(response.content)
+
+    return decode
+
+
+@pytest.fixture(scope="session")
 def client(test_app):
-    """Test client for API testing"""
-    return TestClient(test_app)
+    """Test client for API testing, shared across the session"""
+    from fastapi.testclient import TestClient
+
+    # Entered once so the app lifespan runs once rather than per test
+    with TestClient(test_app) as c:
+        yield c
 
 
 @pytest.fixture
-def temp_docs_dir():
-    """Create temporary docs directory for testing"""
-    temp_dir = tempfile.mkdtemp()
-    docs_dir = os.path.join(temp_dir, "docs")
-    os.makedirs(docs_dir)
+def fresh_client(test_app):
+    """Test client with its own transport for tests that need a pristine one"""
+    from fastapi.testclient import TestClient
+
+    with TestClient(test_app) as c:
+        yield c
+
+
+@pytest.fixture(scope="session")
+def temp_docs_dir(tmp_path_factory):
+    """Temporary docs directory, written once per session; treat as read-only"""
+    docs_dir = tmp_path_factory.mktemp("docs")
     
     # Create sample documents
-    with open(os.path.join(docs_dir, "course1.txt"), "w") as f:
-        f.write("Introduction to RAG\nLesson 1: What is RAG?\nRAG combines retrieval and generation.")
-    
-    with open(os.path.join(docs_dir, "course2.txt"), "w") as f:
-        f.write("Advanced AI\nLesson 1: Vector Embeddings\nEmbeddings represent text numerically.")
+    (docs_dir / "course1.txt").write_text(
+        "Introduction to RAG\nLesson 1: What is RAG?\nRAG combines retrieval and generation."
+    )
+    (docs_dir / "course2.txt").write_text(
+        "Advanced AI\nLesson 1: Vector Embeddings\nEmbeddings represent text numerically."
+    )
     
-    yield docs_dir
-    shutil.rmtree(temp_dir)
+    return str(docs_dir)
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def api_test_data():
     """Test data for API endpoint testing"""
-    return {
-        "query_request": {
-            "query": "What is RAG?",
-            "session_id": "test_session_123"
-        },
-        "query_request_no_session": {
-            "query": "Explain vector embeddings"
-        },
-        "expected_response": {
-            "answer": "Test response",
-            "sources": [{"text": "Test source", "link": "https://example.com"}],
-            "session_id": "test_session_123"
-        },
-        "expected_courses": {
-            "total_courses": 1,
-            "course_titles": ["Test Course"]
-        }
+    query_request = {
+        "query": "What is RAG?",
+        "session_id": "test_session_123"
+    }
+    query_request_no_session = {
+        "query": "Explain vector embeddings"
     }
+    return MappingProxyType(
+        {
+            "query_request": query_request,
+            "query_request_no_session": query_request_no_session,
+            # Pre-serialized bodies for client.post(content=..., headers=...)
+            # so repeated requests skip json.dumps
+            "query_request_bytes": json.dumps(query_request).encode(),
+            "query_request_no_session_bytes": json.dumps(
+                query_request_no_session
+            ).encode(),
+            "plain_query_bytes": json.dumps({"query": "test query"}).encode(),
+            "json_headers": MappingProxyType({"content-type": "application/json"}),
+            "expected_response": {
+                "answer": "Test response",
+                "sources": [{"text": "Test source", "link": "https://example.com"}],
+                "session_id": "test_session_123",
+            },
+            "expected_courses": {"total_courses": 1, "course_titles": ["Test Course"]},
+        }
+    )
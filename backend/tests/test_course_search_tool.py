@@ -5,26 +5,41 @@ Tests the CourseSearchTool class that provides search capabilities for course co
 through the Anthropic tool calling interface.
 """
 
-import os
-import sys
-from unittest.mock import Mock, patch
+from unittest.mock import Mock, call, patch
 
 import pytest
 
-# Add backend to path
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
-
-from search_tools import CourseSearchTool, ToolManager
+from search_tools import CourseOutlineTool, CourseSearchTool, Tool, ToolManager
 from vector_store import SearchResults
 
+# The only shared mock is the vector store, which is reset before every test
+pytestmark = [pytest.mark.parallel]
+
+
+def _assert_search(mock_vector_store, query, course_name=None, lesson_number=None):
+    """Assert the store was searched exactly once with the given filters"""
+    mock_vector_store.search.assert_called_once_with(
+        query=query, course_name=course_name, lesson_number=lesson_number
+    )
+
+
+@pytest.fixture(scope="session")
+def tool_definition():
+    """CourseSearchTool's definition; it is static, so no store is needed"""
+    return CourseSearchTool(None).get_tool_definition()
+
 
 class TestCourseSearchTool:
     """Test cases for CourseSearchTool"""
 
-    def test_tool_definition_structure(self, mock_vector_store):
+    @pytest.fixture
+    def search_tool(self, mock_vector_store):
+        """Fresh CourseSearchTool over the shared vector store mock"""
+        return CourseSearchTool(mock_vector_store)
+
+    def test_tool_definition_structure(self, tool_definition):
         """Test that tool definition has correct structure for Anthropic API"""
-        tool = CourseSearchTool(mock_vector_store)
-        definition = tool.get_tool_definition()
+        definition = tool_definition
 
         # Verify required fields
         assert "name" in definition
@@ -54,108 +69,91 @@ class TestCourseSearchTool:
         assert properties["course_name"]["type"] == "string"
         assert properties["lesson_number"]["type"] == "integer"
 
-    def test_execute_basic_search(self, mock_vector_store, sample_search_results):
+    def test_tool_definition_is_shared(self, search_tool, tool_definition):
+        """Test that every instance returns the same class-level definition"""
+        assert search_tool.get_tool_definition() is tool_definition
+
+    def test_execute_basic_search(
+        self, search_tool, mock_vector_store, sample_search_results
+    ):
         """Test basic search execution without filters"""
         mock_vector_store.search.return_value = sample_search_results
-        mock_vector_store.get_lesson_link.return_value = "https://example.com/lesson1"
 
-        tool = CourseSearchTool(mock_vector_store)
-        result = tool.execute("What is RAG?")
+        result = search_tool.execute("What is RAG?")
 
         # Verify vector store was called correctly
-        mock_vector_store.search.assert_called_once_with(
-            query="What is RAG?", course_name=None, lesson_number=None
-        )
+        _assert_search(mock_vector_store, "What is RAG?")
 
         # Verify result contains expected content
-        assert "[Introduction to RAG Systems - Lesson 1]" in result
-        assert "[Introduction to RAG Systems - Lesson 2]" in result
-        assert "RAG stands for Retrieval-Augmented Generation" in result
-        assert "Vector embeddings are numerical representations" in result
+        assert "[Introduction to RAG Systems - Lesson 1]" in result.text
+        assert "[Introduction to RAG Systems - Lesson 2]" in result.text
+        assert "RAG stands for Retrieval-Augmented Generation" in result.text
+        assert "Vector embeddings are numerical representations" in result.text
 
         # Verify sources were tracked
-        assert len(tool.last_sources) > 0
-
-    def test_execute_with_course_filter(self, mock_vector_store, sample_search_results):
-        """Test search execution with course name filter"""
-        mock_vector_store.search.return_value = sample_search_results
-        mock_vector_store.get_lesson_link.return_value = "https://example.com/lesson1"
-
-        tool = CourseSearchTool(mock_vector_store)
-        result = tool.execute("What is RAG?", course_name="RAG Systems")
-
-        # Verify vector store was called with course filter
-        mock_vector_store.search.assert_called_once_with(
-            query="What is RAG?", course_name="RAG Systems", lesson_number=None
-        )
-
-        assert "Introduction to RAG Systems" in result
-
-    def test_execute_with_lesson_filter(self, mock_vector_store, sample_search_results):
-        """Test search execution with lesson number filter"""
+        assert len(result.sources) > 0
+
+    @pytest.mark.parametrize(
+        "course_name,lesson_number",
+        [("RAG Systems", None), (None, 1), ("RAG Systems", 1)],
+        ids=["course-only", "lesson-only", "both"],
+    )
+    def test_execute_with_filters(
+        self,
+        search_tool,
+        mock_vector_store,
+        sample_search_results,
+        course_name,
+        lesson_number,
+    ):
+        """Test filters are passed through to the vector store search"""
         mock_vector_store.search.return_value = sample_search_results
-        mock_vector_store.get_lesson_link.return_value = "https://example.com/lesson1"
-
-        tool = CourseSearchTool(mock_vector_store)
-        result = tool.execute("What is RAG?", lesson_number=1)
 
-        # Verify vector store was called with lesson filter
-        mock_vector_store.search.assert_called_once_with(
-            query="What is RAG?", course_name=None, lesson_number=1
+        result = search_tool.execute(
+            "What is RAG?", course_name=course_name, lesson_number=lesson_number
         )
 
-        assert "Lesson 1" in result
+        _assert_search(mock_vector_store, "What is RAG?", course_name, lesson_number)
 
-    def test_execute_with_both_filters(self, mock_vector_store, sample_search_results):
-        """Test search execution with both course and lesson filters"""
-        mock_vector_store.search.return_value = sample_search_results
-        mock_vector_store.get_lesson_link.return_value = "https://example.com/lesson1"
+        assert "Introduction to RAG Systems" in result.text
+        assert "Lesson 1" in result.text
 
-        tool = CourseSearchTool(mock_vector_store)
-        result = tool.execute(
-            "What is RAG?", course_name="RAG Systems", lesson_number=1
-        )
-
-        # Verify vector store was called with both filters
-        mock_vector_store.search.assert_called_once_with(
-            query="What is RAG?", course_name="RAG Systems", lesson_number=1
-        )
-
-    def test_execute_empty_results(self, mock_vector_store, empty_search_results):
+    def test_execute_empty_results(
+        self, search_tool, mock_vector_store, empty_search_results
+    ):
         """Test handling of empty search results"""
         mock_vector_store.search.return_value = empty_search_results
 
-        tool = CourseSearchTool(mock_vector_store)
-        result = tool.execute("non-existent content")
+        result = search_tool.execute("non-existent content")
 
-        assert "No relevant content found" in result
+        assert "No relevant content found" in result.text
 
     def test_execute_empty_results_with_filters(
-        self, mock_vector_store, empty_search_results
+        self, search_tool, mock_vector_store, empty_search_results
     ):
         """Test empty results message includes filter information"""
         mock_vector_store.search.return_value = empty_search_results
 
-        tool = CourseSearchTool(mock_vector_store)
-        result = tool.execute(
+        result = search_tool.execute(
             "test query", course_name="Non-existent Course", lesson_number=99
         )
 
         assert (
             "No relevant content found in course 'Non-existent Course' in lesson 99"
-            in result
+            in result.text
         )
 
-    def test_execute_error_results(self, mock_vector_store, error_search_results):
+    def test_execute_error_results(
+        self, search_tool, mock_vector_store, error_search_results
+    ):
         """Test handling of search errors"""
         mock_vector_store.search.return_value = error_search_results
 
-        tool = CourseSearchTool(mock_vector_store)
-        result = tool.execute("test query")
+        result = search_tool.execute("test query")
 
-        assert "Search failed due to connection error" == result
+        assert "Search failed due to connection error" == result.text
 
-    def test_result_formatting(self, mock_vector_store):
+    def test_result_formatting(self, search_tool, mock_vector_store):
         """Test proper formatting of search results"""
         # Create specific test data for formatting
         test_results = SearchResults(
@@ -172,20 +170,19 @@ class TestCourseSearchTool:
             "https://example.com/courseB/lesson2",
         ]
 
-        tool = CourseSearchTool(mock_vector_store)
-        result = tool.execute("test query")
+        result = search_tool.execute("test query")
 
         # Verify formatting structure
-        assert "[Test Course A - Lesson 1]" in result
-        assert "[Test Course B - Lesson 2]" in result
-        assert "First content chunk" in result
-        assert "Second content chunk" in result
+        assert "[Test Course A - Lesson 1]" in result.text
+        assert "[Test Course B - Lesson 2]" in result.text
+        assert "First content chunk" in result.text
+        assert "Second content chunk" in result.text
 
         # Verify chunks are separated properly
-        chunks = result.split("\n\n")
+        chunks = result.text.split("\n\n")
         assert len(chunks) == 2
 
-    def test_source_tracking(self, mock_vector_store):
+    def test_source_tracking(self, search_tool, mock_vector_store):
         """Test that sources are properly tracked for UI display"""
         test_results = SearchResults(
             documents=["Content from course A", "Content from course B"],
@@ -201,22 +198,21 @@ class TestCourseSearchTool:
             "https://example.com/courseB/lesson2",
         ]
 
-        tool = CourseSearchTool(mock_vector_store)
-        tool.execute("test query")
+        result = search_tool.execute("test query")
 
         # Verify sources were tracked
-        assert len(tool.last_sources) == 2
+        assert len(result.sources) == 2
 
         # Verify source structure
-        source1 = tool.last_sources[0]
-        source2 = tool.last_sources[1]
+        source1 = result.sources[0]
+        source2 = result.sources[1]
 
         assert source1["text"] == "Course A - Lesson 1"
         assert source1["link"] == "https://example.com/courseA/lesson1"
         assert source2["text"] == "Course B - Lesson 2"
         assert source2["link"] == "https://example.com/courseB/lesson2"
 
-    def test_source_deduplication(self, mock_vector_store):
+    def test_source_deduplication(self, search_tool, mock_vector_store):
         """Test that duplicate sources are properly deduplicated"""
         # Create results with duplicate course+lesson combinations
         test_results = SearchResults(
@@ -235,17 +231,19 @@ class TestCourseSearchTool:
         mock_vector_store.search.return_value = test_results
         mock_vector_store.get_lesson_link.return_value = "https://example.com/lesson"
 
-        tool = CourseSearchTool(mock_vector_store)
-        tool.execute("test query")
+        result = search_tool.execute("test query")
 
         # Should have only 2 unique sources despite 3 chunks
-        assert len(tool.last_sources) == 2
+        assert len(result.sources) == 2
 
-        source_texts = [source["text"] for source in tool.last_sources]
+        source_texts = [source["text"] for source in result.sources]
         assert "Same Course - Lesson 1" in source_texts
         assert "Same Course - Lesson 2" in source_texts
 
-    def test_source_without_lesson_number(self, mock_vector_store):
+        # Lesson links are looked up once per unique course+lesson
+        assert mock_vector_store.get_lesson_link.call_count == 2
+
+    def test_source_without_lesson_number(self, search_tool, mock_vector_store):
         """Test source formatting when lesson_number is None"""
         test_results = SearchResults(
             documents=["Content without lesson number"],
@@ -255,21 +253,107 @@ class TestCourseSearchTool:
         mock_vector_store.search.return_value = test_results
         mock_vector_store.get_lesson_link.return_value = None
 
-        tool = CourseSearchTool(mock_vector_store)
-        result = tool.execute("test query")
+        result = search_tool.execute("test query")
 
         # Should format without lesson number
-        assert "[Test Course]" in result
-        assert "Lesson" not in result.split("[Test Course]")[1].split("]")[0]
+        assert result.text == "[Test Course]\nContent without lesson number"
 
         # Source should not include lesson number
-        assert tool.last_sources[0]["text"] == "Test Course"
-        assert tool.last_sources[0]["link"] is None
+        assert result.sources[0]["text"] == "Test Course"
+        assert result.sources[0]["link"] is None
+
+
+class TestCourseOutlineTool:
+    """Test cases for CourseOutlineTool"""
+
+    @pytest.fixture
+    def outline_store(self, mock_vector_store):
+        """Vector store mock holding one course with two lessons"""
+        mock_vector_store._resolve_course_name.return_value = "MCP Course"
+        mock_vector_store.course_catalog.get.return_value = {
+            "metadatas": [
+                {
+                    "course_link": "https://example.com/mcp",
+                    "lessons_json": '[{"lesson_number": 1, "lesson_title": "Intro"},'
+                    ' {"lesson_number": 2, "lesson_title": "Clients"}]',
+                }
+            ]
+        }
+        return mock_vector_store
+
+    def test_execute_formats_outline(self, outline_store):
+        """Test outline lists the course link and numbered lessons"""
+        tool = CourseOutlineTool(outline_store)
+
+        result = tool.execute("MCP")
+
+        assert "**Course:** MCP Course" in result
+        assert "**Course Link:** https://example.com/mcp" in result
+        assert "  1. Intro" in result
+        assert "  2. Clients" in result
+
+    def test_title_resolution_normalized(self, outline_store):
+        """Test titles reach the store's memoized lookup stripped and lowercased"""
+        tool = CourseOutlineTool(outline_store)
+
+        tool.execute("MCP")
+        tool.execute(" mcp ")
+
+        # The store caches resolutions, so both calls share one entry
+        assert outline_store._resolve_course_name.call_args_list == [
+            call("mcp"),
+            call("mcp"),
+        ]
+
+    def test_invalidate_all_drops_every_outline(self, outline_store):
+        """Test invalidate without a title rebuilds outlines from the catalog"""
+        tool = CourseOutlineTool(outline_store)
+
+        tool.execute("MCP")
+        tool.invalidate()
+        tool.execute("MCP")
+
+        assert outline_store.course_catalog.get.call_count == 2
+
+    def test_outline_cached_until_invalidated(self, outline_store):
+        """Test repeat outlines skip the catalog lookup until the course changes"""
+        tool = CourseOutlineTool(outline_store)
+
+        first = tool.execute("MCP")
+        assert tool.execute("MCP") == first
+        outline_store.course_catalog.get.assert_called_once_with(ids=["MCP Course"])
+
+        tool.invalidate("MCP Course")
+        tool.execute("MCP")
+        assert outline_store.course_catalog.get.call_count == 2
+
+    def test_missing_metadata_not_cached(self, outline_store):
+        """Test failed lookups are retried rather than cached"""
+        outline_store.course_catalog.get.return_value = {"metadatas": []}
+        tool = CourseOutlineTool(outline_store)
+
+        assert "Course metadata not found" in tool.execute("MCP")
+        tool.execute("MCP")
+
+        assert outline_store.course_catalog.get.call_count == 2
 
 
 class TestToolManager:
     """Test cases for ToolManager"""
 
+    @pytest.fixture(scope="module")
+    def tool_manager(self, _vector_store_mock):
+        """ToolManager with a registered CourseSearchTool, shared by the module
+
+        Built over the session vector store mock that mock_vector_store resets
+        before each test, so tests configure it through mock_vector_store as
+        usual. Sources are collected per collect_sources block, so there is no
+        manager state to reset; tests that register tools build their own.
+        """
+        manager = ToolManager()
+        manager.register_tool(CourseSearchTool(_vector_store_mock))
+        return manager
+
     def test_tool_registration(self, mock_vector_store):
         """Test tool registration in ToolManager"""
         manager = ToolManager()
@@ -280,30 +364,60 @@ class TestToolManager:
         assert "search_course_content" in manager.tools
         assert manager.tools["search_course_content"] == tool
 
-    def test_get_tool_definitions(self, mock_vector_store):
+    def test_get_tool_definitions(self, tool_manager):
         """Test getting tool definitions for Anthropic API"""
+        definitions = tool_manager.get_tool_definitions()
+
+        assert len(definitions) == 1
+        assert definitions[0]["name"] == "search_course_content"
+
+    def test_tool_definitions_cached_until_registration(self, mock_vector_store):
+        """Test definitions are reused and refreshed when a tool is registered"""
         manager = ToolManager()
-        tool = CourseSearchTool(mock_vector_store)
-        manager.register_tool(tool)
+        manager.register_tool(CourseSearchTool(mock_vector_store))
 
         definitions = manager.get_tool_definitions()
+        assert manager.get_tool_definitions() is definitions
 
-        assert len(definitions) == 1
-        assert definitions[0]["name"] == "search_course_content"
+        manager.register_tool(CourseOutlineTool(mock_vector_store))
+        refreshed = manager.get_tool_definitions()
+
+        assert refreshed is not definitions
+        assert [d["name"] for d in refreshed] == [
+            "search_course_content",
+            "get_course_outline",
+        ]
 
-    def test_execute_tool(self, mock_vector_store, sample_search_results):
+    def test_execute_tool(self, tool_manager, mock_vector_store, sample_search_results):
         """Test tool execution through ToolManager"""
         mock_vector_store.search.return_value = sample_search_results
-        mock_vector_store.get_lesson_link.return_value = "https://example.com/lesson1"
 
-        manager = ToolManager()
-        tool = CourseSearchTool(mock_vector_store)
-        manager.register_tool(tool)
-
-        result = manager.execute_tool("search_course_content", query="test query")
+        result = tool_manager.execute_tool("search_course_content", query="test query")
 
+        _assert_search(mock_vector_store, "test query")
         assert "Introduction to RAG Systems" in result
 
+    def test_is_read_only(self, mock_vector_store):
+        """Test read-only classification used for concurrent tool dispatch"""
+
+        class MutatingTool(Tool):
+            is_read_only = False
+
+            def get_tool_definition(self):
+                return {"name": "update_course"}
+
+            def execute(self, **kwargs):
+                return "updated"
+
+        manager = ToolManager()
+        manager.register_tool(CourseSearchTool(mock_vector_store))
+        manager.register_tool(CourseOutlineTool(mock_vector_store))
+        manager.register_tool(MutatingTool())
+
+        assert manager.is_read_only("search_course_content") is True
+        assert manager.is_read_only("get_course_outline") is True
+        assert manager.is_read_only("update_course") is False
+
     def test_execute_nonexistent_tool(self, mock_vector_store):
         """Test execution of non-existent tool"""
         manager = ToolManager()
@@ -312,34 +426,36 @@ class TestToolManager:
 
         assert "Tool 'nonexistent_tool' not found" in result
 
-    def test_get_last_sources(self, mock_vector_store, sample_search_results):
-        """Test retrieving sources from last search operation"""
+    def test_collect_sources(
+        self, tool_manager, mock_vector_store, sample_search_results
+    ):
+        """Test sources returned by tools are collected for the enclosing block"""
         mock_vector_store.search.return_value = sample_search_results
-        mock_vector_store.get_lesson_link.return_value = "https://example.com/lesson1"
-
-        manager = ToolManager()
-        tool = CourseSearchTool(mock_vector_store)
-        manager.register_tool(tool)
 
-        # Execute search to populate sources
-        manager.execute_tool("search_course_content", query="test query")
+        with tool_manager.collect_sources() as sources:
+            result = tool_manager.execute_tool(
+                "search_course_content", query="test query"
+            )
 
-        sources = manager.get_last_sources()
+        # The AI only sees text; sources go to the collector
+        assert isinstance(result, str)
         assert len(sources) > 0
+        assert sources[0]["link"] == "https://example.com/lesson1"
 
-    def test_reset_sources(self, mock_vector_store, sample_search_results):
-        """Test resetting sources after retrieval"""
+    def test_collect_sources_is_scoped(
+        self, tool_manager, mock_vector_store, sample_search_results
+    ):
+        """Test tool calls outside a collect_sources block record nothing"""
         mock_vector_store.search.return_value = sample_search_results
-        mock_vector_store.get_lesson_link.return_value = "https://example.com/lesson1"
 
-        manager = ToolManager()
-        tool = CourseSearchTool(mock_vector_store)
-        manager.register_tool(tool)
+        with tool_manager.collect_sources() as first:
+            tool_manager.execute_tool("search_course_content", query="first")
+        recorded = len(first)
 
-        # Execute search to populate sources
-        manager.execute_tool("search_course_content", query="test query")
-        assert len(manager.get_last_sources()) > 0
+        # Calls after the block must not leak into the finished collector
+        tool_manager.execute_tool("search_course_content", query="outside")
+        with tool_manager.collect_sources() as second:
+            pass
 
-        # Reset sources
-        manager.reset_sources()
-        assert len(manager.get_last_sources()) == 0
+        assert len(first) == recorded
+        assert second == []
@@ -1,317 +1,248 @@
 """
 System diagnosis tests - verify the RAG system works with mock data
 without making expensive API calls.
+
+The findings of the diagnosis these tests came from are in README.md.
 """
 
-import os
-import sys
-from unittest.mock import MagicMock, Mock, patch
+from unittest.mock import DEFAULT, MagicMock, Mock
 
 import pytest
 
-# Add backend to path
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
-
+from ai_generator import AIGenerator
 from rag_system import RAGSystem
+from search_tools import CourseSearchTool, ToolOutput
 from vector_store import SearchResults
 
+# Every test builds its own system through monkeypatched component classes
+pytestmark = [pytest.mark.parallel]
+
+
+def _search_then_respond(query):
+    """Generator side effect that runs one search like Claude would, then answers"""
+
+    def side_effect(**kwargs):
+        kwargs["tool_manager"].execute_tool("search_course_content", query=query)
+        return DEFAULT
+
+    return side_effect
+
 
 class TestSystemDiagnosis:
     """Test the RAG system functionality with mock data to avoid API costs"""
 
-    def test_content_query_uses_search_tool(self):
-        """Test that content queries trigger the search tool correctly"""
-
-        # Create mock config
-        mock_config = Mock()
-        mock_config.CHUNK_SIZE = 800
-        mock_config.CHUNK_OVERLAP = 100
-        mock_config.CHROMA_PATH = "./test_chroma"
-        mock_config.EMBEDDING_MODEL = "test-model"
-        mock_config.MAX_RESULTS = 5
-        mock_config.ANTHROPIC_API_KEY = "test-key"
-        mock_config.ANTHROPIC_MODEL = "claude-sonnet-4-20250514"
-        mock_config.MAX_HISTORY = 2
-
-        with (
-            patch("rag_system.DocumentProcessor"),
-            patch("rag_system.VectorStore"),
-            patch("rag_system.AIGenerator") as mock_ai_gen_class,
-            patch("rag_system.SessionManager"),
+    @pytest.fixture
+    def diagnostic_rag(self, mock_config, monkeypatch):
+        """RAG system with mocked components and a real tool manager"""
+        for name in (
+            "DocumentProcessor",
+            "VectorStore",
+            "AIGenerator",
+            "SessionManager",
         ):
+            monkeypatch.setattr(f"rag_system.{name}", Mock())
+        return RAGSystem(mock_config)
+
+    @pytest.mark.parametrize(
+        "query,search_query,canned_response,source",
+        [
+            (
+                "What is RAG?",
+                "What is RAG?",
+                "RAG is a technique that combines retrieval with generation...",
+                {
+                    "text": "RAG Course - Lesson 1",
+                    "link": "https://example.com/lesson1",
+                },
+            ),
+            # The specific query the user asked about
+            (
+                "What was covered in lesson 5 of the MCP course?",
+                "lesson 5 content",
+                """Lesson 5 of the MCP course covered creating an MCP client. The main topics included:
 
-            # Create RAG system
-            rag = RAGSystem(mock_config)
+- Client setup and connection management
+- Tool integration with the MCP server
+- Implementing the client-server communication protocol
+- Building a complete MCP chatbot client""",
+                {
+                    "text": "MCP: Build Rich-Context AI Apps - Lesson 5",
+                    "link": "https://learn.deeplearning.ai/courses/mcp/lesson5",
+                },
+            ),
+        ],
+        ids=["content-query", "mcp-lesson-5"],
+    )
+    def test_query_scenarios(
+        self, diagnostic_rag, query, search_query, canned_response, source
+    ):
+        """Test content queries run the search tool and return its sources"""
+        rag = diagnostic_rag
+
+        # The patched AIGenerator already built a mock; make it search like
+        # Claude would, then answer
+        mock_ai_gen = rag.ai_generator
+        mock_ai_gen.generate_response.return_value = canned_response
+        mock_ai_gen.generate_response.side_effect = _search_then_respond(search_query)
+
+        # Mock search tool to simulate search results
+        rag.search_tool.execute = Mock(
+            return_value=ToolOutput(f"Content for {source['text']}", [source])
+        )
 
-            # Mock the AI generator instance
-            mock_ai_gen = Mock()
-            mock_ai_gen.generate_response.return_value = (
-                "RAG is a technique that combines retrieval with generation..."
-            )
-            rag.ai_generator = mock_ai_gen
+        response, sources = rag.query(query)
+
+        # Verify AI generator was called with tools
+        mock_ai_gen.generate_response.assert_called_once()
+        call_kwargs = mock_ai_gen.generate_response.call_args[1]
+        assert "tools" in call_kwargs
+        assert call_kwargs["tool_manager"] == rag.tool_manager
+
+        # Verify the tool was searched and its sources returned
+        rag.search_tool.execute.assert_called_once_with(query=search_query)
+        assert response == canned_response
+        assert sources == [source]
+
+    @pytest.fixture
+    def search_tool(self, request, stub_vector_store):
+        """CourseSearchTool over a stub store; request.param is (results, link)"""
+        results, lesson_link = request.param
+        return CourseSearchTool(
+            stub_vector_store(search_result=results, lesson_link=lesson_link)
+        )
 
-            # Mock tool manager to simulate search results
-            rag.tool_manager.get_last_sources = Mock(
-                return_value=[
+    @pytest.mark.parametrize(
+        "search_tool,search_kwargs,expected_text,expected_sources",
+        [
+            (
+                (
+                    SearchResults(
+                        documents=[
+                            "RAG stands for Retrieval-Augmented Generation. It combines retrieval with generation."
+                        ],
+                        metadata=[
+                            {
+                                "course_title": "RAG Systems Course",
+                                "lesson_number": 1,
+                                "chunk_index": 0,
+                            }
+                        ],
+                        distances=[0.1],
+                    ),
+                    "https://example.com/lesson1",
+                ),
+                {"query": "What is RAG?"},
+                (
+                    "[RAG Systems Course - Lesson 1]",
+                    "RAG stands for Retrieval-Augmented Generation",
+                ),
+                [
                     {
-                        "text": "RAG Course - Lesson 1",
+                        "text": "RAG Systems Course - Lesson 1",
                         "link": "https://example.com/lesson1",
                     }
-                ]
-            )
-            rag.tool_manager.reset_sources = Mock()
-
-            # Test content query
-            response, sources = rag.query("What is RAG?")
-
-            # Verify AI generator was called with tools
-            mock_ai_gen.generate_response.assert_called_once()
-            call_kwargs = mock_ai_gen.generate_response.call_args[1]
-
-            # Should have tools available
-            assert "tools" in call_kwargs
-            assert call_kwargs["tool_manager"] == rag.tool_manager
-
-            # Should return response and sources
-            assert (
-                response
-                == "RAG is a technique that combines retrieval with generation..."
-            )
-            assert len(sources) == 1
-            assert sources[0]["text"] == "RAG Course - Lesson 1"
-
-    def test_search_tool_with_real_vector_store_mock(self):
-        """Test search tool functionality with mocked vector store results"""
-        from search_tools import CourseSearchTool
-
-        # Mock vector store
-        mock_vector_store = Mock()
-
-        # Mock search results for "What is RAG?"
-        mock_results = SearchResults(
-            documents=[
-                "RAG stands for Retrieval-Augmented Generation. It combines retrieval with generation."
-            ],
-            metadata=[
-                {
-                    "course_title": "RAG Systems Course",
-                    "lesson_number": 1,
-                    "chunk_index": 0,
-                }
-            ],
-            distances=[0.1],
-        )
-        mock_vector_store.search.return_value = mock_results
-        mock_vector_store.get_lesson_link.return_value = "https://example.com/lesson1"
-
-        # Create search tool
-        search_tool = CourseSearchTool(mock_vector_store)
-
-        # Execute search
-        result = search_tool.execute("What is RAG?")
+                ],
+            ),
+            (
+                (SearchResults(documents=[], metadata=[], distances=[]), None),
+                {"query": "non-existent topic"},
+                ("No relevant content found",),
+                [],
+            ),
+            (
+                (
+                    SearchResults(
+                        documents=[
+                            "MCP enables building rich context AI applications."
+                        ],
+                        metadata=[{"course_title": "MCP Course", "lesson_number": 1}],
+                        distances=[0.05],
+                    ),
+                    "https://example.com/mcp/lesson1",
+                ),
+                {"query": "MCP applications", "course_name": "MCP"},
+                ("[MCP Course - Lesson 1]", "MCP enables building rich context"),
+                [
+                    {
+                        "text": "MCP Course - Lesson 1",
+                        "link": "https://example.com/mcp/lesson1",
+                    }
+                ],
+            ),
+        ],
+        ids=["content-results", "empty-results", "course-filter"],
+        indirect=["search_tool"],
+    )
+    def test_search_tool(
+        self, search_tool, search_kwargs, expected_text, expected_sources
+    ):
+        """Test search tool formatting, sources and filter forwarding"""
+        result = search_tool.execute(**search_kwargs)
+
+        # Verify the store was searched with the given filters
+        assert search_tool.store.last_search == {
+            "query": search_kwargs["query"],
+            "course_name": search_kwargs.get("course_name"),
+            "lesson_number": None,
+        }
 
         # Verify results
-        assert "[RAG Systems Course - Lesson 1]" in result
-        assert "RAG stands for Retrieval-Augmented Generation" in result
+        for text in expected_text:
+            assert text in result.text
 
         # Verify sources were tracked
-        assert len(search_tool.last_sources) == 1
-        assert search_tool.last_sources[0]["text"] == "RAG Systems Course - Lesson 1"
-        assert search_tool.last_sources[0]["link"] == "https://example.com/lesson1"
-
-    def test_search_tool_handles_empty_results(self):
-        """Test search tool handles empty results gracefully"""
-        from search_tools import CourseSearchTool
-
-        mock_vector_store = Mock()
-        empty_results = SearchResults(documents=[], metadata=[], distances=[])
-        mock_vector_store.search.return_value = empty_results
-
-        search_tool = CourseSearchTool(mock_vector_store)
-        result = search_tool.execute("non-existent topic")
+        assert result.sources == expected_sources
 
-        assert "No relevant content found" in result
-        assert len(search_tool.last_sources) == 0
-
-    def test_search_tool_with_course_filter(self):
-        """Test search tool with course name filtering"""
-        from search_tools import CourseSearchTool
-
-        mock_vector_store = Mock()
-
-        # Mock filtered results
-        filtered_results = SearchResults(
-            documents=["MCP enables building rich context AI applications."],
-            metadata=[{"course_title": "MCP Course", "lesson_number": 1}],
-            distances=[0.05],
-        )
-        mock_vector_store.search.return_value = filtered_results
-        mock_vector_store.get_lesson_link.return_value = (
-            "https://example.com/mcp/lesson1"
-        )
-
-        search_tool = CourseSearchTool(mock_vector_store)
-        result = search_tool.execute("MCP applications", course_name="MCP")
-
-        # Verify vector store was called with course filter
-        mock_vector_store.search.assert_called_once_with(
-            query="MCP applications", course_name="MCP", lesson_number=None
-        )
-
-        # Verify results
-        assert "[MCP Course - Lesson 1]" in result
-        assert "MCP enables building rich context" in result
-
-    def test_ai_generator_mock_tool_calling(self):
+    def test_ai_generator_mock_tool_calling(self, anthropic_client):
         """Test AI generator tool calling flow with proper mocks"""
-        from ai_generator import AIGenerator
-
-        with patch("ai_generator.anthropic.Anthropic") as mock_anthropic_class:
-            # Set up mock client
-            mock_client = Mock()
-            mock_anthropic_class.return_value = mock_client
-
-            # Mock tool use response
-            mock_tool_response = Mock()
-            mock_tool_response.stop_reason = "tool_use"
-            mock_tool_block = Mock()
-            mock_tool_block.type = "tool_use"
-            mock_tool_block.name = "search_course_content"
-            mock_tool_block.input = {"query": "RAG systems"}
-            mock_tool_block.id = "tool_123"
-            mock_tool_response.content = [mock_tool_block]
-
-            # Mock final response
-            mock_final_response = Mock()
-            mock_final_content = Mock()
-            mock_final_content.text = (
-                "RAG systems combine retrieval with generation for better AI responses."
-            )
-            mock_final_response.content = [mock_final_content]
-
-            # Set up call sequence
-            mock_client.messages.create.side_effect = [
-                mock_tool_response,
-                mock_final_response,
-            ]
-
-            # Create AI generator
-            generator = AIGenerator("test-key", "test-model")
-
-            # Mock tool manager
-            mock_tool_manager = Mock()
-            mock_tool_manager.execute_tool.return_value = (
-                "Search results about RAG systems..."
-            )
-
-            # Test tool calling
-            response = generator.generate_response(
-                "What are RAG systems?",
-                tools=[{"name": "search_course_content"}],
-                tool_manager=mock_tool_manager,
-            )
-
-            # Verify tool was executed
-            mock_tool_manager.execute_tool.assert_called_once_with(
-                "search_course_content", query="RAG systems"
-            )
-
-            # Verify final response
-            assert (
-                response
-                == "RAG systems combine retrieval with generation for better AI responses."
-            )
-
-    def test_diagnosis_summary(self):
-        """Summarize what we found during diagnosis"""
-
-        # This test documents our findings
-        findings = {
-            "CourseSearchTool": "✅ Working correctly - formats results, tracks sources",
-            "VectorStore": "✅ Working correctly - searches ChromaDB, handles filters",
-            "AIGenerator": "✅ Working correctly - calls tools for content queries",
-            "RAG Integration": "✅ Working correctly - returns sources for content queries",
-            "Tool Usage Decision": "✅ Working correctly - Claude avoids tools for general queries",
-            "Source Tracking": "✅ Working correctly - sources returned to UI",
-            "Test Issues": "❌ Mock setup problems in test files, not system problems",
-        }
 
-        print("\n=== RAG System Diagnosis Summary ===")
-        for component, status in findings.items():
-            print(f"{component}: {status}")
+        # Mock tool use response
+        mock_tool_response = Mock()
+        mock_tool_response.stop_reason = "tool_use"
+        mock_tool_block = Mock()
+        mock_tool_block.type = "tool_use"
+        mock_tool_block.name = "search_course_content"
+        mock_tool_block.input = {"query": "RAG systems"}
+        mock_tool_block.id = "tool_123"
+        mock_tool_response.content = [mock_tool_block]
+
+        # Mock final response
+        mock_final_response = Mock()
+        mock_final_content = Mock()
+        mock_final_content.text = (
+            "RAG systems combine retrieval with generation for better AI responses."
+        )
+        mock_final_response.content = [mock_final_content]
 
-        # The system is working correctly!
-        working_components = [
-            status
-            for component, status in findings.items()
-            if "Test Issues" not in component
+        # Set up call sequence
+        anthropic_client.messages.create.side_effect = [
+            mock_tool_response,
+            mock_final_response,
         ]
-        assert all("✅" in status for status in working_components)
-
-        print("\n✅ CONCLUSION: RAG system is working correctly!")
-        print("The issues were in test setup, not the actual system.")
-
-    def test_specific_course_query_mock(self):
-        """Test the specific query that the user asked about with mock data"""
-
-        # Mock the exact scenario: "What was covered in lesson 5 of the MCP course?"
-        mock_config = Mock()
-        mock_config.CHUNK_SIZE = 800
-        mock_config.CHUNK_OVERLAP = 100
-        mock_config.CHROMA_PATH = "./test_chroma"
-        mock_config.EMBEDDING_MODEL = "test-model"
-        mock_config.MAX_RESULTS = 5
-        mock_config.ANTHROPIC_API_KEY = "test-key"
-        mock_config.ANTHROPIC_MODEL = "claude-sonnet-4-20250514"
-        mock_config.MAX_HISTORY = 2
-
-        with (
-            patch("rag_system.DocumentProcessor"),
-            patch("rag_system.VectorStore"),
-            patch("rag_system.AIGenerator"),
-            patch("rag_system.SessionManager"),
-        ):
 
-            rag = RAGSystem(mock_config)
+        # Create AI generator
+        generator = AIGenerator("test-key", "test-model")
 
-            # Mock AI generator to simulate Claude's response to lesson 5 query
-            mock_ai_gen = Mock()
-            mock_ai_gen.generate_response.return_value = """Lesson 5 of the MCP course covered creating an MCP client. The main topics included:
+        # Mock tool manager
+        mock_tool_manager = Mock()
+        mock_tool_manager.execute_tool.return_value = (
+            "Search results about RAG systems..."
+        )
 
-- Client setup and connection management
-- Tool integration with the MCP server
-- Implementing the client-server communication protocol
-- Building a complete MCP chatbot client"""
+        # Test tool calling
+        response = generator.generate_response(
+            "What are RAG systems?",
+            tools=[{"name": "search_course_content"}],
+            tool_manager=mock_tool_manager,
+        )
 
-            rag.ai_generator = mock_ai_gen
+        # Verify tool was executed
+        mock_tool_manager.execute_tool.assert_called_once_with(
+            "search_course_content", query="RAG systems"
+        )
 
-            # Mock tool manager to simulate finding lesson 5 content
-            rag.tool_manager.get_last_sources = Mock(
-                return_value=[
-                    {
-                        "text": "MCP: Build Rich-Context AI Apps - Lesson 5",
-                        "link": "https://learn.deeplearning.ai/courses/mcp/lesson5",
-                    }
-                ]
-            )
-            rag.tool_manager.reset_sources = Mock()
-
-            # Test the query
-            response, sources = rag.query(
-                "What was covered in lesson 5 of the MCP course?"
-            )
-
-            # Verify it worked as expected
-            assert (
-                "Lesson 5 of the MCP course covered creating an MCP client" in response
-            )
-            assert len(sources) == 1
-            assert "MCP: Build Rich-Context AI Apps - Lesson 5" in sources[0]["text"]
-
-            print("\n✅ Specific course query test passed!")
-            print(f"Query: 'What was covered in lesson 5 of the MCP course?'")
-            print(f"Response length: {len(response)}")
-            print(f"Sources returned: {len(sources)}")
-            print(
-                "This confirms the RAG system handles course content queries correctly."
-            )
+        # Verify final response
+        assert (
+            response
+            == "RAG systems combine retrieval with generation for better AI responses."
+        )
@@ -5,17 +5,20 @@ Tests the VectorStore class that manages ChromaDB collections
 for course metadata and content storage/retrieval.
 """
 
-import os
-import sys
 from unittest.mock import MagicMock, Mock, patch
 
+import numpy as np
 import pytest
-
-# Add backend to path
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from chromadb.api import ClientAPI
+from chromadb.api.models.Collection import Collection
+from chromadb.utils.embedding_functions import SentenceTransformerEmbeddingFunction
 
 from models import Course, CourseChunk, Lesson
-from vector_store import SearchResults, VectorStore
+from vector_store import CachedEmbeddingFunction, SearchResults, VectorStore
+
+# The module's one store and its ChromaDB mocks are reset before every test,
+# and each xdist worker builds its own
+pytestmark = [pytest.mark.parallel]
 
 
 class TestSearchResults:
@@ -47,6 +50,21 @@ class TestSearchResults:
         assert results.distances == []
         assert results.error is None
 
+    def test_from_chroma_batch(self):
+        """Test picking one query's results out of a multi-query response"""
+        chroma_results = {
+            "documents": [["Doc 1"], ["Doc 2", "Doc 3"]],
+            "metadatas": [[{"course": "A"}], [{"course": "B"}, {"course": "C"}]],
+            "distances": [[0.1], [0.2, 0.3]],
+        }
+
+        results = SearchResults.from_chroma_batch(chroma_results, 1)
+
+        assert results.documents == ["Doc 2", "Doc 3"]
+        assert results.metadata == [{"course": "B"}, {"course": "C"}]
+        assert results.distances == [0.2, 0.3]
+        assert results.error is None
+
     def test_empty_with_error(self):
         """Test creating empty SearchResults with error message"""
         results = SearchResults.empty("Test error message")
@@ -64,22 +82,88 @@ class TestSearchResults:
         assert empty_results.is_empty() is True
         assert non_empty_results.is_empty() is False
 
+    def test_search_results_has_slots(self):
+        """Test instances carry no per-instance __dict__"""
+        results = SearchResults([], [], [])
+
+        assert not hasattr(results, "__dict__")
+        with pytest.raises(AttributeError):
+            results.unknown = "value"
+
+
+class TestCachedEmbeddingFunction:
+    """Test cases for the text-keyed embedding cache"""
+
+    @pytest.fixture
+    def inner(self):
+        """Embedding function mock whose vector is the text length"""
+        return Mock(side_effect=lambda input: [[float(len(text))] for text in input])
+
+    def test_repeated_texts_embedded_once(self, inner):
+        """Test only texts not seen before reach the wrapped function"""
+        embed = CachedEmbeddingFunction(inner)
+
+        first = embed(["aa", "bbb", "aa"])
+        second = embed(["bbb", "c"])
+
+        # Duplicates within and across calls are embedded once
+        assert [c.args[0] for c in inner.call_args_list] == [["aa", "bbb"], ["c"]]
+        assert [list(e) for e in first] == [[2.0], [3.0], [2.0]]
+        assert [list(e) for e in second] == [[3.0], [1.0]]
+
+    def test_oldest_entries_dropped(self, inner):
+        """Test the cache keeps at most max_entries embeddings"""
+        embed = CachedEmbeddingFunction(inner, max_entries=2)
+
+        for text in ("a", "b", "c", "c", "a"):
+            embed([text])
+
+        # "a" was evicted when "c" arrived, so it is embedded again
+        assert [c.args[0] for c in inner.call_args_list] == [
+            ["a"],
+            ["b"],
+            ["c"],
+            ["a"],
+        ]
+
+    def test_eviction_during_embedding(self):
+        """Test a key evicted by another call mid-embedding is still returned"""
+
+        def inner(input):
+            # Another caller fills the cache while "b" is being embedded
+            if input == ["b"]:
+                embed(["c", "d"])
+            return [[float(ord(text))] for text in input]
+
+        embed = CachedEmbeddingFunction(inner, max_entries=2)
+        embed(["a"])
+
+        embeddings = embed(["a", "b"])
+
+        # "a" was evicted before this call finished, yet is in its result
+        assert [list(e) for e in embeddings] == [[97.0], [98.0]]
+
+    def test_reports_wrapped_configuration(self, inner):
+        """Test collections see the wrapped sentence transformer function"""
+        inner.get_config.return_value = {"model_name": "test-model"}
+        embed = CachedEmbeddingFunction(inner)
+
+        assert embed.name() == "sentence_transformer"
+        assert embed.get_config() == {"model_name": "test-model"}
+
 
 class TestVectorStore:
     """Test cases for VectorStore"""
 
-    @pytest.fixture
-    def mock_chroma_client(self):
-        """Mock ChromaDB client"""
-        mock_client = Mock()
-        mock_collection = Mock()
+    @pytest.fixture(scope="module")
+    def _chroma_store(self):
+        """VectorStore over a mocked ChromaDB client, built once per module"""
+        # Spec'd on the real client and collection so a misspelled or
+        # removed Chroma method fails instead of returning a child mock
+        mock_client = Mock(spec=ClientAPI)
+        mock_collection = Mock(spec=Collection)
+        mock_lessons = Mock(spec=Collection)
         mock_client.get_or_create_collection.return_value = mock_collection
-        return mock_client, mock_collection
-
-    @pytest.fixture
-    def vector_store(self, mock_chroma_client):
-        """Create VectorStore with mocked ChromaDB"""
-        mock_client, mock_collection = mock_chroma_client
 
         with (
             patch("vector_store.chromadb.PersistentClient", return_value=mock_client),
@@ -87,161 +171,192 @@ class TestVectorStore:
                 "vector_store.chromadb.utils.embedding_functions.SentenceTransformerEmbeddingFunction"
             ),
         ):
-
             store = VectorStore("./test_chroma", "test-model", max_results=3)
-            store.course_catalog = mock_collection
-            store.course_content = mock_collection
-            return store, mock_client, mock_collection
 
-    def test_initialization(self):
-        """Test VectorStore initialization"""
-        with (
-            patch("vector_store.chromadb.PersistentClient") as mock_client_class,
-            patch(
-                "vector_store.chromadb.utils.embedding_functions.SentenceTransformerEmbeddingFunction"
-            ) as mock_embedding,
-        ):
+        return store, mock_client, mock_collection, mock_lessons
 
-            mock_client = Mock()
-            mock_client_class.return_value = mock_client
-            mock_collection = Mock()
-            mock_client.get_or_create_collection.return_value = mock_collection
+    @pytest.fixture
+    def vector_store(self, _chroma_store):
+        """Shared VectorStore with its ChromaDB mocks and catalog caches reset
+
+        The catalog and content collections are one collection mock; the
+        lessons collection has its own, since add_course_metadata writes to
+        both. Tests that stub a store method do it through monkeypatch, so
+        the override is undone.
+        """
+        store, mock_client, mock_collection, mock_lessons = _chroma_store
+        mock_client.reset_mock(return_value=True, side_effect=True)
+        mock_collection.reset_mock(return_value=True, side_effect=True)
+        mock_lessons.reset_mock(return_value=True, side_effect=True)
+        mock_client.get_or_create_collection.return_value = mock_collection
+        # clear_all_data reassigns every collection
+        store.course_catalog = store.course_content = mock_collection
+        store.course_lessons = mock_lessons
+        store._cached_course_name.cache_clear()
+        store._course_titles = None
+        store._title_id_cache.clear()
+        return store, mock_client, mock_collection
+
+    def test_initialization(self, monkeypatch):
+        """Test VectorStore initialization"""
+        mock_client = Mock(spec=ClientAPI)
+        mock_client_class = Mock(return_value=mock_client)
+        mock_embedding = Mock()
+        monkeypatch.setattr("vector_store.chromadb.PersistentClient", mock_client_class)
+        monkeypatch.setattr(
+            "vector_store.chromadb.utils.embedding_functions.SentenceTransformerEmbeddingFunction",
+            mock_embedding,
+        )
 
-            store = VectorStore("./test_path", "test-embedding-model", max_results=10)
+        store = VectorStore("./test_path", "test-embedding-model", max_results=10)
 
-            # Verify ChromaDB client was created correctly
-            mock_client_class.assert_called_once()
-            assert mock_client_class.call_args[1]["path"] == "./test_path"
+        # Verify ChromaDB client was created correctly
+        mock_client_class.assert_called_once()
+        assert mock_client_class.call_args[1]["path"] == "./test_path"
 
-            # Verify embedding function was set up
-            mock_embedding.assert_called_once_with(model_name="test-embedding-model")
+        # Verify embedding function was set up
+        mock_embedding.assert_called_once_with(model_name="test-embedding-model")
 
-            # Verify collections were created
-            assert mock_client.get_or_create_collection.call_count == 2
+        # Verify collections were created
+        assert mock_client.get_or_create_collection.call_count == 3
 
-            # Verify max_results is set
-            assert store.max_results == 10
+        # Verify max_results is set
+        assert store.max_results == 10
 
-    def test_search_basic_query(self, vector_store):
-        """Test basic search without filters"""
+    @pytest.mark.parametrize(
+        "course_name,lesson_number,expected_where",
+        [
+            (None, None, None),
+            (
+                "Partial Course",
+                None,
+                {"course_title": {"$eq": "Resolved Course Name"}},
+            ),
+            (None, 2, {"lesson_number": {"$eq": 2}}),
+            (
+                "Partial Course",
+                1,
+                {
+                    "$and": [
+                        {"course_title": {"$eq": "Resolved Course Name"}},
+                        {"lesson_number": {"$eq": 1}},
+                    ]
+                },
+            ),
+        ],
+        ids=["no-filter", "course-filter", "lesson-filter", "both-filters"],
+    )
+    def test_search_filter_variations(
+        self, vector_store, monkeypatch, course_name, lesson_number, expected_where
+    ):
+        """Test search resolves the course and filters content accordingly"""
         store, mock_client, mock_collection = vector_store
 
+        # Mock course name resolution
+        resolve = Mock(return_value="Resolved Course Name")
+        monkeypatch.setattr(store, "_resolve_course_name", resolve)
+
         # Mock ChromaDB query response
+        metadata = {"course_title": "Resolved Course Name", "lesson_number": 1}
         mock_collection.query.return_value = {
             "documents": [["Test document content"]],
-            "metadatas": [[{"course_title": "Test Course", "lesson_number": 1}]],
+            "metadatas": [[metadata]],
             "distances": [[0.1]],
         }
 
-        results = store.search("test query")
+        results = store.search(
+            "test query", course_name=course_name, lesson_number=lesson_number
+        )
 
-        # Verify query was called correctly
+        # Verify the course name was resolved only when one was given
+        if course_name:
+            resolve.assert_called_once_with(course_name)
+        else:
+            resolve.assert_not_called()
+
+        # Verify query was called with the matching filter
         mock_collection.query.assert_called_once_with(
             query_texts=["test query"],
             n_results=3,  # max_results from fixture
-            where=None,
+            where=expected_where,
         )
 
         # Verify results
-        assert len(results.documents) == 1
-        assert results.documents[0] == "Test document content"
-        assert results.metadata[0]["course_title"] == "Test Course"
+        assert results.documents == ["Test document content"]
+        assert results.metadata == [metadata]
         assert results.error is None
 
-    def test_search_with_course_filter(self, vector_store):
-        """Test search with course name filter"""
+    def test_search_course_not_found(self, vector_store, monkeypatch):
+        """Test search when course name cannot be resolved"""
         store, mock_client, mock_collection = vector_store
 
-        # Mock course name resolution
-        store._resolve_course_name = Mock(return_value="Resolved Course Name")
+        monkeypatch.setattr(store, "_resolve_course_name", lambda name: None)
 
-        mock_collection.query.return_value = {
-            "documents": [["Filtered content"]],
-            "metadatas": [[{"course_title": "Resolved Course Name"}]],
-            "distances": [[0.2]],
-        }
-
-        results = store.search("test query", course_name="Partial Course")
-
-        # Verify course name was resolved
-        store._resolve_course_name.assert_called_once_with("Partial Course")
+        results = store.search("test query", course_name="Nonexistent Course")
 
-        # Verify query was called with filter
-        mock_collection.query.assert_called_once_with(
-            query_texts=["test query"],
-            n_results=3,
-            where={"course_title": "Resolved Course Name"},
-        )
+        # Should return error without querying
+        assert results.error == "No course found matching 'Nonexistent Course'"
+        assert results.documents == []
+        mock_collection.query.assert_not_called()
 
-    def test_search_with_lesson_filter(self, vector_store):
-        """Test search with lesson number filter"""
+    def test_search_exception_handling(self, vector_store):
+        """Test search error handling"""
         store, mock_client, mock_collection = vector_store
 
-        mock_collection.query.return_value = {
-            "documents": [["Lesson content"]],
-            "metadatas": [[{"lesson_number": 2}]],
-            "distances": [[0.15]],
-        }
+        mock_collection.query.side_effect = Exception("Database error")
 
-        results = store.search("test query", lesson_number=2)
+        results = store.search("test query")
 
-        # Verify query was called with lesson filter
-        mock_collection.query.assert_called_once_with(
-            query_texts=["test query"], n_results=3, where={"lesson_number": 2}
-        )
+        assert "Search error: Database error" in results.error
+        assert results.documents == []
 
-    def test_search_with_both_filters(self, vector_store):
-        """Test search with both course and lesson filters"""
+    def test_search_batch(self, vector_store, monkeypatch):
+        """Test several queries are sent to ChromaDB in one call"""
         store, mock_client, mock_collection = vector_store
-
-        store._resolve_course_name = Mock(return_value="Test Course")
+        monkeypatch.setattr(store, "_resolve_course_name", lambda name: "Test Course")
 
         mock_collection.query.return_value = {
-            "documents": [["Specific content"]],
-            "metadatas": [[{"course_title": "Test Course", "lesson_number": 1}]],
-            "distances": [[0.05]],
+            "documents": [["First answer"], ["Second answer"]],
+            "metadatas": [[{"lesson_number": 1}], [{"lesson_number": 2}]],
+            "distances": [[0.1], [0.2]],
         }
 
-        results = store.search("test query", course_name="Test", lesson_number=1)
+        results = store.search_batch(["first", "second"], course_name="Test")
 
-        # Verify query was called with combined filter
-        expected_filter = {
-            "$and": [{"course_title": "Test Course"}, {"lesson_number": 1}]
-        }
+        # One query call carries both texts and the shared filter
         mock_collection.query.assert_called_once_with(
-            query_texts=["test query"], n_results=3, where=expected_filter
+            query_texts=["first", "second"],
+            n_results=3,
+            where={"course_title": {"$eq": "Test Course"}},
         )
+        assert [r.documents for r in results] == [["First answer"], ["Second answer"]]
+        assert [r.metadata for r in results] == [
+            [{"lesson_number": 1}],
+            [{"lesson_number": 2}],
+        ]
 
-    def test_search_course_not_found(self, vector_store):
-        """Test search when course name cannot be resolved"""
+    def test_search_batch_course_not_found(self, vector_store, monkeypatch):
+        """Test every query gets the error when the course cannot be resolved"""
         store, mock_client, mock_collection = vector_store
+        monkeypatch.setattr(store, "_resolve_course_name", lambda name: None)
 
-        store._resolve_course_name = Mock(return_value=None)
+        results = store.search_batch(["first", "second"], course_name="Nope")
 
-        results = store.search("test query", course_name="Nonexistent Course")
-
-        # Should return error without querying
-        assert results.error == "No course found matching 'Nonexistent Course'"
-        assert results.documents == []
+        assert [r.error for r in results] == ["No course found matching 'Nope'"] * 2
         mock_collection.query.assert_not_called()
 
-    def test_search_exception_handling(self, vector_store):
-        """Test search error handling"""
+    def test_search_batch_no_queries(self, vector_store):
+        """Test an empty batch returns no results without querying"""
         store, mock_client, mock_collection = vector_store
 
-        mock_collection.query.side_effect = Exception("Database error")
-
-        results = store.search("test query")
-
-        assert "Search error: Database error" in results.error
-        assert results.documents == []
+        assert store.search_batch([]) == []
+        mock_collection.query.assert_not_called()
 
     def test_resolve_course_name_success(self, vector_store):
         """Test successful course name resolution"""
         store, mock_client, mock_collection = vector_store
 
         # Mock catalog query for course name resolution
-        store.course_catalog = Mock()
         store.course_catalog.query.return_value = {
             "documents": [["Course Title"]],
             "metadatas": [[{"title": "Full Course Title"}]],
@@ -260,13 +375,44 @@ class TestVectorStore:
         """Test course name resolution when no match found"""
         store, mock_client, mock_collection = vector_store
 
-        store.course_catalog = Mock()
         store.course_catalog.query.return_value = {"documents": [[]], "metadatas": [[]]}
 
         result = store._resolve_course_name("Nonexistent Course")
 
         assert result is None
 
+    def test_resolve_course_name_cached(self, vector_store, sample_course):
+        """Test resolved names are reused until the catalog changes"""
+        store, mock_client, mock_collection = vector_store
+        store.course_catalog.query.return_value = {
+            "documents": [["Course Title"]],
+            "metadatas": [[{"title": "Full Course Title"}]],
+        }
+
+        assert store._resolve_course_name("Partial Name") == "Full Course Title"
+        assert store._resolve_course_name("Partial Name") == "Full Course Title"
+        store.course_catalog.query.assert_called_once()
+
+        # Adding a course may change the best match
+        store.add_course_metadata(sample_course)
+        store._resolve_course_name("Partial Name")
+        assert store.course_catalog.query.call_count == 2
+
+        store.clear_all_data()
+        store._resolve_course_name("Partial Name")
+        assert store.course_catalog.query.call_count == 3
+
+    def test_resolve_course_name_error_not_cached(self, vector_store):
+        """Test a failed catalog query is retried on the next lookup"""
+        store, mock_client, mock_collection = vector_store
+        store.course_catalog.query.side_effect = [
+            Exception("Database error"),
+            {"documents": [["Course Title"]], "metadatas": [[{"title": "Course"}]]},
+        ]
+
+        assert store._resolve_course_name("Partial Name") is None
+        assert store._resolve_course_name("Partial Name") == "Course"
+
     def test_build_filter_combinations(self, vector_store):
         """Test filter building for different parameter combinations"""
         store, mock_client, mock_collection = vector_store
@@ -276,21 +422,25 @@ class TestVectorStore:
 
         # Test course only
         course_filter = store._build_filter("Course A", None)
-        assert course_filter == {"course_title": "Course A"}
+        assert course_filter == {"course_title": {"$eq": "Course A"}}
 
         # Test lesson only
         lesson_filter = store._build_filter(None, 3)
-        assert lesson_filter == {"lesson_number": 3}
+        assert lesson_filter == {"lesson_number": {"$eq": 3}}
 
         # Test both
         combined_filter = store._build_filter("Course B", 2)
-        expected = {"$and": [{"course_title": "Course B"}, {"lesson_number": 2}]}
+        expected = {
+            "$and": [
+                {"course_title": {"$eq": "Course B"}},
+                {"lesson_number": {"$eq": 2}},
+            ]
+        }
         assert combined_filter == expected
 
     def test_add_course_metadata(self, vector_store, sample_course):
         """Test adding course metadata to catalog"""
         store, mock_client, mock_collection = vector_store
-        store.course_catalog = Mock()
 
         store.add_course_metadata(sample_course)
 
@@ -316,10 +466,118 @@ class TestVectorStore:
         assert lessons[0]["lesson_number"] == 1
         assert lessons[0]["lesson_title"] == "What is RAG?"
 
+        # Verify each lesson got its own row for link lookups, without
+        # embedding the lesson titles
+        store.course_lessons.upsert.assert_called_once_with(
+            embeddings=[[0.0], [0.0]],
+            metadatas=[
+                {
+                    "course_title": "Introduction to RAG Systems",
+                    "lesson_number": 1,
+                    "lesson_link": "https://example.com/rag-course/lesson1",
+                },
+                {
+                    "course_title": "Introduction to RAG Systems",
+                    "lesson_number": 2,
+                    "lesson_link": "https://example.com/rag-course/lesson2",
+                },
+            ],
+            ids=[
+                # Same title digest as the course's chunk IDs, lesson number last
+                "5aab292a52d949bd00000001",
+                "5aab292a52d949bd00000002",
+            ],
+        )
+
+    def test_add_course_metadata_lesson_without_link(self, vector_store):
+        """Test a lesson without a link is stored without the link key"""
+        store, mock_client, mock_collection = vector_store
+        course = Course(
+            title="Course", lessons=[Lesson(lesson_number=1, title="Intro")]
+        )
+
+        store.add_course_metadata(course)
+
+        # Chroma rejects None metadata values
+        metadatas = store.course_lessons.upsert.call_args[1]["metadatas"]
+        assert metadatas == [{"course_title": "Course", "lesson_number": 1}]
+
+    def test_add_course_metadata_repeated_lesson_number(self, vector_store):
+        """Test a repeated lesson header yields one row, keeping the first"""
+        store, mock_client, mock_collection = vector_store
+        course = Course(
+            title="Course",
+            lessons=[
+                Lesson(lesson_number=1, title="Intro", lesson_link="https://a"),
+                Lesson(lesson_number=1, title="Intro again", lesson_link="https://b"),
+            ],
+        )
+
+        store.add_course_metadata(course)
+
+        # Duplicate IDs in one write would raise DuplicateIDError
+        call_args = store.course_lessons.upsert.call_args[1]
+        assert call_args["ids"] == ["c2ece6d7dc52c42300000001"]
+        assert call_args["metadatas"] == [
+            {"course_title": "Course", "lesson_number": 1, "lesson_link": "https://a"}
+        ]
+
+    def test_add_course_metadata_replaces_lesson_rows(self, vector_store):
+        """Test re-ingesting a course drops rows for lessons it no longer has"""
+        store, mock_client, mock_collection = vector_store
+        course = Course(
+            title="Course", lessons=[Lesson(lesson_number=1, title="Intro")]
+        )
+
+        store.add_course_metadata(course)
+
+        # The course's old rows go first, then its current ones are written
+        assert [c[0] for c in store.course_lessons.mock_calls] == ["delete", "upsert"]
+        store.course_lessons.delete.assert_called_once_with(
+            where={"course_title": {"$eq": "Course"}}
+        )
+
+    def test_add_course_metadata_without_lessons_clears_rows(self, vector_store):
+        """Test a course re-ingested with no lessons keeps no lesson rows"""
+        store, mock_client, mock_collection = vector_store
+
+        store.add_course_metadata(Course(title="Course"))
+
+        store.course_lessons.delete.assert_called_once_with(
+            where={"course_title": {"$eq": "Course"}}
+        )
+        store.course_lessons.upsert.assert_not_called()
+
+    def test_lesson_ids_distinct_for_similar_titles(self, vector_store):
+        """Test titles differing only in spaces vs underscores keep separate rows"""
+        store, mock_client, mock_collection = vector_store
+
+        for title in ("A B", "A_B"):
+            store.add_course_metadata(
+                Course(title=title, lessons=[Lesson(lesson_number=1, title="Intro")])
+            )
+
+        first, second = (
+            c[1]["ids"] for c in store.course_lessons.upsert.call_args_list
+        )
+        assert first != second
+
+    def test_add_course_metadata_lesson_failure_skips_catalog(
+        self, vector_store, sample_course
+    ):
+        """Test a failed lesson write leaves the course out of the catalog"""
+        store, mock_client, mock_collection = vector_store
+        store.course_lessons.upsert.side_effect = Exception("write failed")
+
+        with pytest.raises(Exception, match="write failed"):
+            store.add_course_metadata(sample_course)
+
+        # Without a catalog row the course is loaded again on the next run
+        store.course_catalog.add.assert_not_called()
+
     def test_add_course_content(self, vector_store, sample_course_chunks):
         """Test adding course content chunks"""
         store, mock_client, mock_collection = vector_store
-        store.course_content = Mock()
 
         store.add_course_content(sample_course_chunks)
 
@@ -342,18 +600,54 @@ class TestVectorStore:
         ]
         assert call_args["metadatas"] == expected_metadata
 
-        # Verify IDs format
+        # Verify IDs format: 16 hex digits of title digest, then 8 of chunk index
         expected_ids = [
-            "Introduction_to_RAG_Systems_0",
-            "Introduction_to_RAG_Systems_1",
-            "Introduction_to_RAG_Systems_2",
+            "5aab292a52d949bd00000000",
+            "5aab292a52d949bd00000001",
+            "5aab292a52d949bd00000002",
         ]
         assert call_args["ids"] == expected_ids
 
+    @pytest.mark.parametrize(
+        "course_title,chunk_index,expected_id",
+        [
+            ("Introduction to RAG Systems", 0, "5aab292a52d949bd00000000"),
+            ("Introduction to RAG Systems", 255, "5aab292a52d949bd000000ff"),
+            ("MCP", 1, "4439d2d7dc7bbdbe00000001"),
+        ],
+    )
+    def test_make_id(self, vector_store, course_title, chunk_index, expected_id):
+        """Test chunk IDs are the fixed-width title hash and chunk index"""
+        store, mock_client, mock_collection = vector_store
+
+        assert store._make_id(course_title, chunk_index) == expected_id
+        # The title hash is computed once and reused
+        assert store._title_id_cache == {course_title: expected_id[:16]}
+
+    def test_add_course_content_in_batches(self, vector_store, sample_course_chunks):
+        """Test content chunks are written batch_size at a time"""
+        store, mock_client, mock_collection = vector_store
+
+        store.add_course_content(sample_course_chunks, batch_size=2)
+
+        # Three chunks in batches of two: one full batch, then the remainder
+        assert store.course_content.add.call_count == 2
+        batch_ids = [call[1]["ids"] for call in store.course_content.add.call_args_list]
+        assert batch_ids == [
+            ["5aab292a52d949bd00000000", "5aab292a52d949bd00000001"],
+            ["5aab292a52d949bd00000002"],
+        ]
+        batch_docs = [
+            call[1]["documents"] for call in store.course_content.add.call_args_list
+        ]
+        assert batch_docs == [
+            [chunk.content for chunk in sample_course_chunks[:2]],
+            [sample_course_chunks[2].content],
+        ]
+
     def test_add_course_content_empty(self, vector_store):
         """Test adding empty course content list"""
         store, mock_client, mock_collection = vector_store
-        store.course_content = Mock()
 
         store.add_course_content([])
 
@@ -367,34 +661,51 @@ class TestVectorStore:
         store.clear_all_data()
 
         # Verify collections were deleted
-        assert mock_client.delete_collection.call_count == 2
+        assert mock_client.delete_collection.call_count == 3
         collection_names = [
             call[0][0] for call in mock_client.delete_collection.call_args_list
         ]
         assert "course_catalog" in collection_names
         assert "course_content" in collection_names
+        assert "course_lessons" in collection_names
 
-        # Verify collections were recreated
-        # get_or_create_collection is called twice in init + twice in clear
-        assert mock_client.get_or_create_collection.call_count >= 4
+        # Verify collections were recreated; the construction calls were
+        # reset with the shared store, so only clear's three remain
+        assert mock_client.get_or_create_collection.call_count == 3
 
     def test_get_existing_course_titles(self, vector_store):
         """Test retrieving existing course titles"""
         store, mock_client, mock_collection = vector_store
-        store.course_catalog = Mock()
         store.course_catalog.get.return_value = {
             "ids": ["Course A", "Course B", "Course C"]
         }
 
         titles = store.get_existing_course_titles()
 
-        store.course_catalog.get.assert_called_once()
+        store.course_catalog.get.assert_called_once_with(include=[])
         assert titles == ["Course A", "Course B", "Course C"]
 
+    def test_get_existing_course_titles_cached(self, vector_store, sample_course):
+        """Test course titles are fetched once until the catalog changes"""
+        store, mock_client, mock_collection = vector_store
+        store.course_catalog.get.return_value = {"ids": ["Course A"]}
+
+        assert store.get_existing_course_titles() == ["Course A"]
+        assert store.get_existing_course_titles() == ["Course A"]
+        store.course_catalog.get.assert_called_once()
+
+        # Writes to the catalog drop the cached titles
+        store.add_course_metadata(sample_course)
+        store.get_existing_course_titles()
+        assert store.course_catalog.get.call_count == 2
+
+        store.clear_all_data()
+        store.get_existing_course_titles()
+        assert store.course_catalog.get.call_count == 3
+
     def test_get_existing_course_titles_empty(self, vector_store):
         """Test retrieving course titles when none exist"""
         store, mock_client, mock_collection = vector_store
-        store.course_catalog = Mock()
         store.course_catalog.get.return_value = {"ids": []}
 
         titles = store.get_existing_course_titles()
@@ -404,20 +715,19 @@ class TestVectorStore:
     def test_get_course_count(self, vector_store):
         """Test getting course count"""
         store, mock_client, mock_collection = vector_store
-        store.course_catalog = Mock()
-        store.course_catalog.get.return_value = {
-            "ids": ["Course 1", "Course 2", "Course 3", "Course 4"]
-        }
+        store.course_catalog.count.return_value = 4
 
         count = store.get_course_count()
 
+        # Counted by Chroma, without fetching the IDs
+        store.course_catalog.count.assert_called_once()
+        store.course_catalog.get.assert_not_called()
         assert count == 4
 
     def test_get_course_count_empty(self, vector_store):
         """Test getting course count when no courses exist"""
         store, mock_client, mock_collection = vector_store
-        store.course_catalog = Mock()
-        store.course_catalog.get.return_value = {"ids": []}
+        store.course_catalog.count.return_value = 0
 
         count = store.get_course_count()
 
@@ -426,7 +736,6 @@ class TestVectorStore:
     def test_get_course_link(self, vector_store):
         """Test retrieving course link"""
         store, mock_client, mock_collection = vector_store
-        store.course_catalog = Mock()
         store.course_catalog.get.return_value = {
             "metadatas": [{"course_link": "https://example.com/course"}]
         }
@@ -439,7 +748,6 @@ class TestVectorStore:
     def test_get_course_link_not_found(self, vector_store):
         """Test retrieving course link when course not found"""
         store, mock_client, mock_collection = vector_store
-        store.course_catalog = Mock()
         store.course_catalog.get.return_value = {"metadatas": []}
 
         link = store.get_course_link("Nonexistent Course")
@@ -449,7 +757,29 @@ class TestVectorStore:
     def test_get_lesson_link(self, vector_store):
         """Test retrieving lesson link"""
         store, mock_client, mock_collection = vector_store
-        store.course_catalog = Mock()
+        store.course_lessons.get.return_value = {
+            "metadatas": [{"lesson_link": "https://example.com/lesson2"}]
+        }
+
+        link = store.get_lesson_link("Test Course", 2)
+
+        # A metadata lookup on the lesson's row, without the catalog JSON
+        store.course_lessons.get.assert_called_once_with(
+            where={
+                "$and": [
+                    {"course_title": {"$eq": "Test Course"}},
+                    {"lesson_number": {"$eq": 2}},
+                ]
+            },
+            include=["metadatas"],
+        )
+        store.course_catalog.get.assert_not_called()
+        assert link == "https://example.com/lesson2"
+
+    def test_get_lesson_link_from_catalog(self, vector_store):
+        """Test courses stored before lesson rows fall back to the catalog"""
+        store, mock_client, mock_collection = vector_store
+        store.course_lessons.get.return_value = {"metadatas": []}
 
         # Mock course metadata with lessons
         lessons_json = '[{"lesson_number": 1, "lesson_link": "https://example.com/lesson1"}, {"lesson_number": 2, "lesson_link": "https://example.com/lesson2"}]'
@@ -465,7 +795,7 @@ class TestVectorStore:
     def test_get_lesson_link_not_found(self, vector_store):
         """Test retrieving lesson link when lesson not found"""
         store, mock_client, mock_collection = vector_store
-        store.course_catalog = Mock()
+        store.course_lessons.get.return_value = {"metadatas": []}
 
         lessons_json = (
             '[{"lesson_number": 1, "lesson_link": "https://example.com/lesson1"}]'
@@ -481,7 +811,6 @@ class TestVectorStore:
     def test_get_all_courses_metadata(self, vector_store):
         """Test retrieving all course metadata with parsed lessons"""
         store, mock_client, mock_collection = vector_store
-        store.course_catalog = Mock()
 
         lessons_json = '[{"lesson_number": 1, "lesson_title": "Intro"}]'
         store.course_catalog.get.return_value = {
@@ -523,3 +852,68 @@ class TestVectorStore:
         mock_collection.query.assert_called_once_with(
             query_texts=["test query"], n_results=10, where=None
         )
+
+
+class _StubSentenceTransformer(SentenceTransformerEmbeddingFunction):
+    """384-dimensional stand-in that never loads or downloads a model"""
+
+    def __init__(self, model_name="all-MiniLM-L6-v2", **kwargs):
+        self.model_name = model_name
+        self.device = "cpu"
+        self.normalize_embeddings = False
+        self.kwargs = {}
+
+    @staticmethod
+    def build_from_config(config):
+        return _StubSentenceTransformer(config["model_name"])
+
+    def __call__(self, input):
+        return [np.full(384, float(len(text)), dtype=np.float32) for text in input]
+
+
+class TestVectorStoreChroma:
+    """Test cases for VectorStore against a real ChromaDB collection"""
+
+    @pytest.fixture
+    def chroma_store(self, tmp_path):
+        with patch(
+            "vector_store.chromadb.utils.embedding_functions."
+            "SentenceTransformerEmbeddingFunction",
+            _StubSentenceTransformer,
+        ):
+            yield VectorStore(str(tmp_path), "all-MiniLM-L6-v2")
+
+    def test_lesson_placeholder_embedding_accepted(self, chroma_store):
+        """Lesson rows keep their 1-dimensional placeholder beside 384-dimensional content"""
+        course = Course(
+            title="Test Course",
+            instructor="Test Instructor",
+            course_link="https://example.com/course",
+            lessons=[
+                Lesson(
+                    lesson_number=1,
+                    title="Intro",
+                    lesson_link="https://example.com/lesson1",
+                )
+            ],
+        )
+
+        chroma_store.add_course_metadata(course)
+        chroma_store.add_course_content(
+            [
+                CourseChunk(
+                    content="Lesson content",
+                    course_title="Test Course",
+                    lesson_number=1,
+                    chunk_index=0,
+                )
+            ]
+        )
+
+        assert (
+            chroma_store.get_lesson_link("Test Course", 1)
+            == "https://example.com/lesson1"
+        )
+        assert chroma_store.course_lessons.count() == 1
+        content = chroma_store.course_content.get(include=["embeddings"])
+        assert len(content["embeddings"][0]) == 384
@@ -1,13 +1,31 @@
+import hashlib
+import json
+import threading
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import Any, Dict, List, Optional
 
 import chromadb
+from chromadb.api.types import Documents, Embedding, EmbeddingFunction, Embeddings
 from chromadb.config import Settings
 from models import Course, CourseChunk
-from sentence_transformers import SentenceTransformer
 
+# orjson is optional; when installed it parses the stored lessons JSON, which
+# is read back for every catalog listing (and links of courses stored before
+# the lessons collection existed)
+try:
+    import orjson
+except ImportError:
+    _loads_json = json.loads
+else:
+    _loads_json = orjson.loads
 
-@dataclass
+
+# Rows in the lessons collection are looked up by metadata alone
+_LESSON_ROW_EMBEDDING = [0.0]
+
+
+@dataclass(slots=True)
 class SearchResults:
     """Container for search results with metadata"""
 
@@ -19,15 +37,26 @@ class SearchResults:
     @classmethod
     def from_chroma(cls, chroma_results: Dict) -> "SearchResults":
         """Create SearchResults from ChromaDB query results"""
+        return cls.from_chroma_batch(chroma_results, 0)
+
+    @classmethod
+    def from_chroma_batch(cls, chroma_results: Dict, index: int) -> "SearchResults":
+        """Create SearchResults for one query of a multi-query ChromaDB result"""
         return cls(
             documents=(
-                chroma_results["documents"][0] if chroma_results["documents"] else []
+                chroma_results["documents"][index]
+                if chroma_results["documents"]
+                else []
             ),
             metadata=(
-                chroma_results["metadatas"][0] if chroma_results["metadatas"] else []
+                chroma_results["metadatas"][index]
+                if chroma_results["metadatas"]
+                else []
             ),
             distances=(
-                chroma_results["distances"][0] if chroma_results["distances"] else []
+                chroma_results["distances"][index]
+                if chroma_results["distances"]
+                else []
             ),
         )
 
@@ -41,6 +70,84 @@ class SearchResults:
         return len(self.documents) == 0
 
 
+class CachedEmbeddingFunction(EmbeddingFunction[Documents]):
+    """Sentence transformer embedding function that embeds each distinct text once
+
+    Embeddings are keyed by a hash of the text and the oldest are dropped
+    past max_entries. The cache is shared by concurrent tool calls, so it is
+    only touched under a lock; the wrapped function runs outside it. Reports
+    itself as the wrapped function, so collections persisted with it still
+    open.
+    """
+
+    def __init__(self, inner: EmbeddingFunction[Documents], max_entries: int = 10000):
+        self._inner = inner
+        self._max_entries = max_entries
+        self._cache: Dict[bytes, Embedding] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, input: Documents) -> Embeddings:
+        keys = [
+            hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+            for text in input
+        ]
+
+        # Embed only the texts not seen before, each distinct one once. The
+        # result is built from these local values, so another thread evicting
+        # a key afterwards cannot affect it
+        found: Dict[bytes, Embedding] = {}
+        missing: Dict[bytes, str] = {}
+        with self._lock:
+            for key, text in zip(keys, input):
+                if key in self._cache:
+                    found[key] = self._cache[key]
+                else:
+                    missing.setdefault(key, text)
+
+        if missing:
+            embedded = dict(zip(missing, self._inner(list(missing.values()))))
+            found.update(embedded)
+            with self._lock:
+                self._cache.update(embedded)
+                while len(self._cache) > self._max_entries:
+                    del self._cache[next(iter(self._cache))]
+
+        return [found[key] for key in keys]
+
+    # Name, config and spaces are those of the wrapped function
+    @staticmethod
+    def name() -> str:
+        return "sentence_transformer"
+
+    def default_space(self):
+        return self._inner.default_space()
+
+    def supported_spaces(self):
+        return self._inner.supported_spaces()
+
+    @staticmethod
+    def build_from_config(config: Dict[str, Any]) -> "CachedEmbeddingFunction":
+        return CachedEmbeddingFunction(
+            chromadb.utils.embedding_functions.SentenceTransformerEmbeddingFunction.build_from_config(
+                config
+            )
+        )
+
+    def get_config(self) -> Dict[str, Any]:
+        return self._inner.get_config()
+
+    def validate_config_update(
+        self, old_config: Dict[str, Any], new_config: Dict[str, Any]
+    ) -> None:
+        self._inner.validate_config_update(old_config, new_config)
+
+    @staticmethod
+    def validate_config(config: Dict[str, Any]) -> None:
+        chromadb.utils.embedding_functions.SentenceTransformerEmbeddingFunction.validate_config(
+            config
+        )
+
+
 class VectorStore:
     """Vector storage using ChromaDB for course content and metadata"""
 
@@ -51,8 +158,8 @@ class VectorStore:
             path=chroma_path, settings=Settings(anonymized_telemetry=False)
         )
 
-        # Set up sentence transformer embedding function
-        self.embedding_function = (
+        # Set up sentence transformer embedding function, cached by text
+        self.embedding_function = CachedEmbeddingFunction(
             chromadb.utils.embedding_functions.SentenceTransformerEmbeddingFunction(
                 model_name=embedding_model
             )
@@ -65,6 +172,16 @@ class VectorStore:
         self.course_content = self._create_collection(
             "course_content"
         )  # Actual course material
+        self.course_lessons = self._create_collection(
+            "course_lessons"
+        )  # One row per lesson, for link lookups
+
+        # Partial names resolve to the same title until the catalog changes
+        self._cached_course_name = lru_cache(maxsize=512)(self._query_course_name)
+        # Catalog IDs, fetched on first use and dropped whenever the catalog changes
+        self._course_titles: Optional[List[str]] = None
+        # 64-bit title hash in hex per course, the prefix of its chunk IDs
+        self._title_id_cache: Dict[str, str] = {}
 
     def _create_collection(self, name: str):
         """Create or get a ChromaDB collection"""
@@ -113,19 +230,65 @@ class VectorStore:
         except Exception as e:
             return SearchResults.empty(f"Search error: {str(e)}")
 
+    def search_batch(
+        self,
+        queries: List[str],
+        course_name: Optional[str] = None,
+        lesson_number: Optional[int] = None,
+        limit: Optional[int] = None,
+    ) -> List[SearchResults]:
+        """
+        Search course content for several queries in one ChromaDB call.
+
+        The queries share the course and lesson filters, so the course name
+        is resolved once and every query is embedded in the same pass.
+
+        Returns:
+            One SearchResults per query, in the order given
+        """
+        if not queries:
+            return []
+
+        course_title = None
+        if course_name:
+            course_title = self._resolve_course_name(course_name)
+            if not course_title:
+                error = f"No course found matching '{course_name}'"
+                return [SearchResults.empty(error) for _ in queries]
+
+        filter_dict = self._build_filter(course_title, lesson_number)
+        search_limit = limit if limit is not None else self.max_results
+
+        try:
+            results = self.course_content.query(
+                query_texts=list(queries), n_results=search_limit, where=filter_dict
+            )
+        except Exception as e:
+            return [SearchResults.empty(f"Search error: {str(e)}") for _ in queries]
+
+        return [
+            SearchResults.from_chroma_batch(results, i) for i in range(len(queries))
+        ]
+
     def _resolve_course_name(self, course_name: str) -> Optional[str]:
         """Use vector search to find best matching course by name"""
         try:
-            results = self.course_catalog.query(query_texts=[course_name], n_results=1)
-
-            if results["documents"][0] and results["metadatas"][0]:
-                # Return the title (which is now the ID)
-                return results["metadatas"][0][0]["title"]
+            return self._cached_course_name(course_name)
         except Exception as e:
             print(f"Error resolving course name: {e}")
 
         return None
 
+    def _query_course_name(self, course_name: str) -> Optional[str]:
+        """Uncached catalog lookup; errors propagate so they are never cached"""
+        results = self.course_catalog.query(query_texts=[course_name], n_results=1)
+
+        if results["documents"][0] and results["metadatas"][0]:
+            # Return the title (which is now the ID)
+            return results["metadatas"][0][0]["title"]
+
+        return None
+
     def _build_filter(
         self, course_title: Optional[str], lesson_number: Optional[int]
     ) -> Optional[Dict]:
@@ -133,28 +296,29 @@ class VectorStore:
         if not course_title and lesson_number is None:
             return None
 
-        # Handle different filter combinations
+        # Handle different filter combinations, with explicit $eq operators
         if course_title and lesson_number is not None:
             return {
                 "$and": [
-                    {"course_title": course_title},
-                    {"lesson_number": lesson_number},
+                    {"course_title": {"$eq": course_title}},
+                    {"lesson_number": {"$eq": lesson_number}},
                 ]
             }
 
         if course_title:
-            return {"course_title": course_title}
+            return {"course_title": {"$eq": course_title}}
 
-        return {"lesson_number": lesson_number}
+        return {"lesson_number": {"$eq": lesson_number}}
 
     def add_course_metadata(self, course: Course):
         """Add course information to the catalog for semantic search"""
-        import json
-
         course_text = course.title
 
         # Build lessons metadata and serialize as JSON string
         lessons_metadata = []
+        # One row per lesson number; a repeated "Lesson N:" header keeps the
+        # first, which is also the one the catalog JSON lookup finds
+        lesson_rows: Dict[int, Dict[str, Any]] = {}
         for lesson in course.lessons:
             lessons_metadata.append(
                 {
@@ -163,6 +327,29 @@ class VectorStore:
                     "lesson_link": lesson.lesson_link,
                 }
             )
+            if lesson.lesson_number in lesson_rows:
+                continue
+            # Chroma metadata cannot hold None, so a missing link is left out
+            row = {"course_title": course.title, "lesson_number": lesson.lesson_number}
+            if lesson.lesson_link:
+                row["lesson_link"] = lesson.lesson_link
+            lesson_rows[lesson.lesson_number] = row
+
+        # Each lesson also gets its own row, so get_lesson_link is a metadata
+        # lookup instead of a parse of the course's lessons JSON. Re-ingesting
+        # a course replaces its rows: the old ones are deleted first, so
+        # lessons the course no longer has stop returning stale links, then
+        # the current ones are upserted. Both happen before the catalog write
+        # so a failure never leaves the course marked as loaded without them.
+        # The rows are only ever filtered by metadata, so a placeholder
+        # embedding stands in for embedding the lesson titles
+        self.course_lessons.delete(where={"course_title": {"$eq": course.title}})
+        if lesson_rows:
+            self.course_lessons.upsert(
+                embeddings=[_LESSON_ROW_EMBEDDING] * len(lesson_rows),
+                metadatas=list(lesson_rows.values()),
+                ids=[self._make_id(course.title, number) for number in lesson_rows],
+            )
 
         self.course_catalog.add(
             documents=[course_text],
@@ -179,67 +366,90 @@ class VectorStore:
             ],
             ids=[course.title],
         )
+        self._cached_course_name.cache_clear()
+        self._course_titles = None
 
-    def add_course_content(self, chunks: List[CourseChunk]):
-        """Add course content chunks to the vector store"""
-        if not chunks:
-            return
-
-        documents = [chunk.content for chunk in chunks]
-        metadatas = [
-            {
-                "course_title": chunk.course_title,
-                "lesson_number": chunk.lesson_number,
-                "chunk_index": chunk.chunk_index,
-            }
-            for chunk in chunks
-        ]
-        # Use title with chunk index for unique IDs
-        ids = [
-            f"{chunk.course_title.replace(' ', '_')}_{chunk.chunk_index}"
-            for chunk in chunks
-        ]
+    def add_course_content(self, chunks: List[CourseChunk], batch_size: int = 100):
+        """Add course content chunks to the vector store
 
-        self.course_content.add(documents=documents, metadatas=metadatas, ids=ids)
+        Chunks are written batch_size at a time, so a large course takes a
+        few add calls (one write transaction each) instead of one per chunk.
+        """
+        for start in range(0, len(chunks), batch_size):
+            batch = chunks[start : start + batch_size]
+            documents = [chunk.content for chunk in batch]
+            metadatas = [
+                {
+                    "course_title": chunk.course_title,
+                    "lesson_number": chunk.lesson_number,
+                    "chunk_index": chunk.chunk_index,
+                }
+                for chunk in batch
+            ]
+            ids = [
+                self._make_id(chunk.course_title, chunk.chunk_index) for chunk in batch
+            ]
+
+            self.course_content.add(documents=documents, metadatas=metadatas, ids=ids)
+
+    def _make_id(self, course_title: str, index: int) -> str:
+        """Build a fixed-width row ID from the title hash and an index
+
+        The index is the chunk index for content rows and the lesson number
+        for lesson rows. IDs are 24 hex characters: a 64-bit blake2b digest
+        of the title followed by the index, so they stay short however long
+        the course title is. Two titles sharing a digest would share IDs and
+        Chroma would drop or overwrite the other's rows, so the digest is
+        kept wide.
+        """
+        title_id = self._title_id_cache.get(course_title)
+        if title_id is None:
+            title_id = hashlib.blake2b(
+                course_title.encode("utf-8"), digest_size=8
+            ).hexdigest()
+            self._title_id_cache[course_title] = title_id
+        return f"{title_id}{index:08x}"
 
     def clear_all_data(self):
-        """Clear all data from both collections"""
+        """Clear all data from every collection"""
+        self._cached_course_name.cache_clear()
+        self._course_titles = None
         try:
             self.client.delete_collection("course_catalog")
             self.client.delete_collection("course_content")
+            self.client.delete_collection("course_lessons")
             # Recreate collections
             self.course_catalog = self._create_collection("course_catalog")
             self.course_content = self._create_collection("course_content")
+            self.course_lessons = self._create_collection("course_lessons")
         except Exception as e:
             print(f"Error clearing data: {e}")
 
     def get_existing_course_titles(self) -> List[str]:
         """Get all existing course titles from the vector store"""
-        try:
-            # Get all documents from the catalog
-            results = self.course_catalog.get()
-            if results and "ids" in results:
-                return results["ids"]
-            return []
-        except Exception as e:
-            print(f"Error getting existing course titles: {e}")
-            return []
+        if self._course_titles is None:
+            try:
+                # Titles are the catalog IDs, so fetch nothing else
+                results = self.course_catalog.get(include=[])
+                if results and "ids" in results:
+                    self._course_titles = results["ids"]
+                else:
+                    self._course_titles = []
+            except Exception as e:
+                print(f"Error getting existing course titles: {e}")
+                return []
+        return list(self._course_titles)
 
     def get_course_count(self) -> int:
         """Get the total number of courses in the vector store"""
         try:
-            results = self.course_catalog.get()
-            if results and "ids" in results:
-                return len(results["ids"])
-            return 0
+            return self.course_catalog.count()
         except Exception as e:
             print(f"Error getting course count: {e}")
             return 0
 
     def get_all_courses_metadata(self) -> List[Dict[str, Any]]:
         """Get metadata for all courses in the vector store"""
-        import json
-
         try:
             results = self.course_catalog.get()
             if results and "metadatas" in results:
@@ -248,7 +458,9 @@ class VectorStore:
                 for metadata in results["metadatas"]:
                     course_meta = metadata.copy()
                     if "lessons_json" in course_meta:
-                        course_meta["lessons"] = json.loads(course_meta["lessons_json"])
+                        course_meta["lessons"] = _loads_json(
+                            course_meta["lessons_json"]
+                        )
                         del course_meta[
                             "lessons_json"
                         ]  # Remove the JSON string version
@@ -274,20 +486,32 @@ class VectorStore:
 
     def get_lesson_link(self, course_title: str, lesson_number: int) -> Optional[str]:
         """Get lesson link for a given course title and lesson number"""
-        import json
-
         try:
-            # Get course by ID (title is the ID)
-            results = self.course_catalog.get(ids=[course_title])
-            if results and "metadatas" in results and results["metadatas"]:
-                metadata = results["metadatas"][0]
-                lessons_json = metadata.get("lessons_json")
-                if lessons_json:
-                    lessons = json.loads(lessons_json)
-                    # Find the lesson with matching number
-                    for lesson in lessons:
-                        if lesson.get("lesson_number") == lesson_number:
-                            return lesson.get("lesson_link")
-            return None
+            results = self.course_lessons.get(
+                where=self._build_filter(course_title, lesson_number),
+                include=["metadatas"],
+            )
+            if results and results["metadatas"]:
+                return results["metadatas"][0].get("lesson_link")
+            # Courses added before lessons had their own rows
+            return self._catalog_lesson_link(course_title, lesson_number)
         except Exception as e:
             print(f"Error getting lesson link: {e}")
+            return None
+
+    def _catalog_lesson_link(
+        self, course_title: str, lesson_number: int
+    ) -> Optional[str]:
+        """Find a lesson link in the course's catalog lessons JSON"""
+        # Get course by ID (title is the ID)
+        results = self.course_catalog.get(ids=[course_title])
+        if results and "metadatas" in results and results["metadatas"]:
+            metadata = results["metadatas"][0]
+            lessons_json = metadata.get("lessons_json")
+            if lessons_json:
+                lessons = _loads_json(lessons_json)
+                # Find the lesson with matching number
+                for lesson in lessons:
+                    if lesson.get("lesson_number") == lesson_number:
+                        return lesson.get("lesson_link")
+        return None